@@ -0,0 +1,239 @@
+"""Areal averaging of gridded forcing over catchments.
+
+The fraction of every catchment covered by every grid cell is kept as a
+sparse (n_catchments x n_cells) matrix in CSR form, so that averaging one
+time step of a variable is one sparse matrix-vector product:
+
+    weights = ArealWeights.from_polygons("catchments.geojson", x, y)
+    weights.save("weights.npz")
+    values = weights.aggregate(cells)   # (n_times x ny x nx) window
+
+Coverage is the exact area of the intersection of each catchment polygon
+(GeoJSON Polygon or MultiPolygon, holes included) with each cell, the
+cells being the rectangles around the ``x`` and ``y`` coordinates of the
+grid, in the planar units of the grid. Polygons must be in the
+coordinate system of the grid.
+"""
+
+import json
+import os
+
+import numpy as np
+
+# products held at once when aggregating a block of time steps
+_BLOCK_PRODUCTS = 2**24
+
+_loaded = {}
+
+
+class ArealWeights(object):
+
+    """Sparse coverage weights of catchments over a grid."""
+
+    def __init__(self, catchment_ids, indptr, indices, weights, grid_shape):
+        """Create weights from CSR arrays.
+
+        Parameters
+        ----------
+        catchment_ids : list of str
+            Catchment of every row.
+        indptr : ndarray
+            Start of the cells of every catchment in ``indices``, plus
+            the total; every catchment has at least one cell.
+        indices : ndarray
+            Flat ``y*nx + x`` index of every cell.
+        weights : ndarray
+            Weight of every cell; those of a catchment sum to one.
+        grid_shape : tuple of int
+            ``(ny, nx)`` of the grid.
+        """
+        self.catchment_ids = [str(c) for c in catchment_ids]
+        self.indptr = np.asarray(indptr, dtype=np.int64)
+        self.indices = np.asarray(indices, dtype=np.int64)
+        self.weights = np.asarray(weights, dtype=np.float64)
+        self.grid_shape = tuple(int(n) for n in grid_shape)
+        if np.any(np.diff(self.indptr) <= 0):
+            empty = np.flatnonzero(np.diff(self.indptr) <= 0)
+            raise ValueError("catchment " + self.catchment_ids[empty[0]] + " covers no grid cell")
+
+        # smallest window of the grid holding every weighted cell, and the
+        # cell indices relative to it
+        rows, cols = np.divmod(self.indices, self.grid_shape[1])
+        self.window = (int(rows.min()), int(rows.max()) + 1, int(cols.min()), int(cols.max()) + 1)
+        y0, y1, x0, x1 = self.window
+        self._window_indices = (rows - y0) * (x1 - x0) + cols - x0
+
+    @classmethod
+    def load(cls, filename):
+        """Read weights saved by ``save``, once per process and file version."""
+        stat = os.stat(filename)
+        key = (os.path.abspath(filename), stat.st_mtime_ns, stat.st_size)
+        weights = _loaded.get(key)
+        if weights is None:
+            with np.load(filename) as npz:
+                weights = cls(npz["catchment_ids"].tolist(), npz["indptr"], npz["indices"],
+                              npz["weights"], npz["grid_shape"])
+            _loaded[key] = weights
+        return weights
+
+    def save(self, filename):
+        """Write the weights to a ``.npz`` file."""
+        with open(filename, "wb") as f:
+            np.savez(f, catchment_ids=np.array(self.catchment_ids), indptr=self.indptr,
+                     indices=self.indices, weights=self.weights,
+                     grid_shape=np.array(self.grid_shape))
+
+    @classmethod
+    def from_polygons(cls, filename, x, y, id_field="id"):
+        """Compute coverage weights of GeoJSON polygons over a grid.
+
+        Parameters
+        ----------
+        filename : str
+            GeoJSON FeatureCollection, one feature per catchment.
+        x, y : array_like
+            Monotonic cell center coordinates of the grid.
+        id_field : str, optional
+            Feature property holding the catchment id, the feature ``id``
+            if absent.
+
+        Returns
+        -------
+        ArealWeights
+            Weights, one row per feature.
+        """
+        with open(filename) as f:
+            features = json.load(f)["features"]
+        x_edges = _cell_edges(x)
+        y_edges = _cell_edges(y)
+        nx = len(x_edges) - 1
+
+        catchment_ids = []
+        indptr = [0]
+        indices = []
+        weights = []
+        for feature in features:
+            catchment_ids.append(str(feature.get("properties", {}).get(id_field, feature.get("id"))))
+            cells, areas = _coverage(feature["geometry"], x_edges, y_edges)
+            keep = areas > 0
+            indices.append(cells[keep, 0] * nx + cells[keep, 1])
+            weights.append(areas[keep] / areas[keep].sum() if keep.any() else areas[keep])
+            indptr.append(indptr[-1] + int(keep.sum()))
+        return cls(catchment_ids, indptr, np.concatenate(indices), np.concatenate(weights),
+                   (len(y_edges) - 1, nx))
+
+    def subset(self, catchment_ids):
+        """Weights of ``catchment_ids``, in that order."""
+        row = {c: i for i, c in enumerate(self.catchment_ids)}
+        missing = [c for c in catchment_ids if str(c) not in row]
+        if missing:
+            raise ValueError("no weights for catchment " + ", ".join(str(c) for c in missing[:5]))
+        rows = [row[str(c)] for c in catchment_ids]
+        counts = np.diff(self.indptr)[rows]
+        take = np.concatenate([np.arange(self.indptr[r], self.indptr[r+1]) for r in rows])
+        return ArealWeights([str(c) for c in catchment_ids], np.r_[0, np.cumsum(counts)],
+                            self.indices[take], self.weights[take], self.grid_shape)
+
+    def aggregate(self, cells):
+        """Catchment averages of gridded values.
+
+        Parameters
+        ----------
+        cells : ndarray
+            (n_times x ny x nx) values of the ``window`` of the grid.
+
+        Returns
+        -------
+        ndarray
+            (n_times x n_catchments) averages.
+        """
+        flat = cells.reshape(len(cells), -1)
+        out = np.empty((len(cells), len(self.catchment_ids)), dtype=np.result_type(cells, np.float32))
+        step = max(1, _BLOCK_PRODUCTS // len(self.weights))
+        for beg in range(0, len(cells), step):
+            products = flat[beg:beg+step, self._window_indices] * self.weights
+            out[beg:beg+step] = np.add.reduceat(products, self.indptr[:-1], axis=1)
+        return out
+
+
+def _cell_edges(centers):
+    """Edges of the cells around monotonic ``centers``."""
+    centers = np.asarray(centers, dtype=np.float64)
+    if len(centers) == 1:
+        return np.array([centers[0] - 0.5, centers[0] + 0.5])
+    mid = (centers[1:] + centers[:-1]) / 2
+    return np.r_[2*centers[0] - mid[0], mid, 2*centers[-1] - mid[-1]]
+
+
+def _rings(geometry):
+    """``(ring, sign)`` of every ring of a Polygon or MultiPolygon, holes negative."""
+    polygons = geometry["coordinates"]
+    if geometry["type"] == "Polygon":
+        polygons = [polygons]
+    elif geometry["type"] != "MultiPolygon":
+        raise ValueError("unsupported catchment geometry " + geometry["type"])
+    for polygon in polygons:
+        for i, ring in enumerate(polygon):
+            yield np.asarray(ring, dtype=np.float64)[:, :2], -1. if i else 1.
+
+
+def _clip(ring, axis, bound, upper):
+    """Part of ``ring`` on one side of the line ``coordinate[axis] == bound``.
+
+    One Sutherland-Hodgman step, vectorized over the edges.
+    """
+    if len(ring) == 0:
+        return ring
+    side = ring[:, axis] - bound
+    if upper:
+        side = -side
+    inside = side >= 0
+    following = np.roll(ring, -1, axis=0)
+    side_following = np.roll(side, -1)
+    crossing = inside != np.roll(inside, -1)
+    t = side[crossing] / (side[crossing] - side_following[crossing])
+    points = ring[crossing] + t[:, None] * (following[crossing] - ring[crossing])
+    # per edge: its start if inside, then the crossing point if any
+    counts = inside.astype(np.int64) + crossing
+    start = np.cumsum(counts) - counts
+    out = np.empty((counts.sum(), 2))
+    out[start[inside]] = ring[inside]
+    out[start[crossing] + inside[crossing]] = points
+    return out
+
+
+def _area(ring):
+    """Area of a ring by the shoelace formula."""
+    if len(ring) < 3:
+        return 0.
+    x, y = ring[:, 0], ring[:, 1]
+    return abs(np.dot(x, np.roll(y, -1)) - np.dot(np.roll(x, -1), y)) / 2
+
+
+def _coverage(geometry, x_edges, y_edges):
+    """Cells a geometry overlaps and the area of every overlap.
+
+    Returns
+    -------
+    tuple of ndarray
+        (n x 2) ``(row, column)`` of the cells and their overlap areas.
+    """
+    x_lo = np.minimum(x_edges[:-1], x_edges[1:])
+    x_hi = np.maximum(x_edges[:-1], x_edges[1:])
+    y_lo = np.minimum(y_edges[:-1], y_edges[1:])
+    y_hi = np.maximum(y_edges[:-1], y_edges[1:])
+    areas = {}
+    for ring, sign in _rings(geometry):
+        # the ring is cut into column strips, then every strip into cells
+        columns = np.flatnonzero((x_hi > ring[:, 0].min()) & (x_lo < ring[:, 0].max()))
+        for col in columns:
+            strip = _clip(_clip(ring, 0, x_lo[col], False), 0, x_hi[col], True)
+            if len(strip) < 3:
+                continue
+            rows = np.flatnonzero((y_hi > strip[:, 1].min()) & (y_lo < strip[:, 1].max()))
+            for row in rows:
+                area = _area(_clip(_clip(strip, 1, y_lo[row], False), 1, y_hi[row], True))
+                if area > 0:
+                    areas[row, col] = areas.get((row, col), 0.) + sign * area
+    cells = np.array(sorted(areas), dtype=np.int64).reshape(-1, 2)
+    return cells, np.array([areas[tuple(c)] for c in cells], dtype=np.float64)
@@ -0,0 +1,234 @@
+"""Benchmark the BMI Forcing hot path and the NetCDF load path.
+
+Synthetic forcing files with a catchment dimension are generated (once,
+then reused) for every combination of catchment count and years of
+hourly data, and each case is timed in a fresh process:
+
+- initialize: YAML parsing, NetCDF open and ``read_forcing``
+- step: one ``update`` plus one ``get_value`` per output variable
+- get_value_at_indices: one gather of a random index set
+- update_until: one jump from the start to the end of the window
+
+Results, including the peak RSS of each case, are written to JSON so
+they can be compared between commits.
+
+    python benchmark_bmi.py --catchments 1 1000 50000 --years 1 30 --output bench.json
+"""
+
+import json
+import os
+import platform
+import resource
+import subprocess
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+import numpy as np
+import yaml
+
+# name, units and range of the uniform synthetic values of each variable
+SYNTHETIC_VARIABLES = {
+    'LWDOWN': ('W m-2', 150., 450.),
+    'PSFC': ('Pa', 80000., 105000.),
+    'Q2D': ('kg kg-1', 0., 0.02),
+    'RAINRATE': ('mm s^-1', 0., 0.005),
+    'SWDOWN': ('W m-2', 0., 1000.),
+    'T2D': ('K', 240., 310.),
+    'U2D': ('m s-1', -10., 10.),
+    'V2D': ('m s-1', -10., 10.),
+}
+TIME_ORIGIN = "2000-01-01 00:00:00"
+
+
+def make_forcing_file(filename, n_catchments, n_times, seed=0):
+    """Write a synthetic forcing file with a catchment dimension.
+
+    Parameters
+    ----------
+    filename : str
+        File to write.
+    n_catchments : int
+        Number of catchments.
+    n_times : int
+        Number of hourly time steps.
+    seed : int, optional
+        Random seed.
+    """
+    import netCDF4 as netcdf
+
+    rng = np.random.default_rng(seed)
+    with netcdf.Dataset(filename, "w") as nc:
+        nc.createDimension("catchment-id", n_catchments)
+        nc.createDimension("Time", n_times)
+        time_var = nc.createVariable("Time", "f8", ("Time",))
+        time_var.units = "hours since " + TIME_ORIGIN
+        time_var.calendar = "proleptic_gregorian"
+        time_var[:] = np.arange(n_times)
+        cat_id = nc.createVariable("catID", str, ("catchment-id",))
+        cat_id.long_name = "catchment ID"
+        cat_id[:] = np.array(["cat-" + str(i) for i in range(n_catchments)], dtype=object)
+
+        # write in time blocks of about 16M values to bound memory
+        block = max(1, 2**24 // n_catchments)
+        for name, (units, low, high) in SYNTHETIC_VARIABLES.items():
+            var = nc.createVariable(name, "f4", ("catchment-id", "Time"))
+            var.long_name = name
+            var.units = units
+            for beg in range(0, n_times, block):
+                end = min(beg + block, n_times)
+                var[:, beg:end] = rng.uniform(low, high, (n_catchments, end - beg)).astype("f4")
+
+
+def run_case(cfg_file, n_steps, n_indices):
+    """Time one configuration; runs in its own process.
+
+    Parameters
+    ----------
+    cfg_file : str
+        Configuration file.
+    n_steps : int
+        Number of steps to time for the per-step cost.
+    n_indices : int
+        Size of the index set given to ``get_value_at_indices``.
+
+    Returns
+    -------
+    dict
+        Timings in seconds and peak RSS in bytes.
+    """
+    from bmi_forcing import BmiForcing
+
+    bmi = BmiForcing()
+    tic = time.perf_counter()
+    bmi.initialize(cfg_file)
+    initialize = time.perf_counter() - tic
+
+    # forcing variables only; derived ones are computed on first request
+    names = bmi._forcing_var_names
+    size = bmi.get_grid_size(0)
+    dest = np.empty(size, dtype=float)
+    n_steps = max(1, min(n_steps, bmi._data_end_index()))
+    tic = time.perf_counter()
+    for _ in range(n_steps):
+        bmi.update()
+        for name in names:
+            bmi.get_value(name, dest)
+    step = (time.perf_counter() - tic) / n_steps
+
+    indices = np.random.default_rng(0).integers(0, size, min(n_indices, size))
+    dest_indices = np.empty(len(indices), dtype=float)
+    n_calls = 1000
+    tic = time.perf_counter()
+    for _ in range(n_calls):
+        bmi.get_value_at_indices(names[0], dest_indices, indices)
+    at_indices = (time.perf_counter() - tic) / n_calls
+
+    bmi.finalize()
+    bmi = BmiForcing()
+    bmi.initialize(cfg_file)
+    tic = time.perf_counter()
+    bmi.update_until(bmi.get_end_time() * bmi.get_time_step())
+    update_until = time.perf_counter() - tic
+    bmi.finalize()
+
+    return {"initialize_seconds": initialize,
+            "step_seconds": step,
+            "get_value_at_indices_seconds": at_indices,
+            "update_until_seconds": update_until,
+            "peak_rss_bytes": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024}
+
+
+def git_commit():
+    """Commit of the working tree, if it is a git checkout."""
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], text=True,
+                                       cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(catchments, years, data_dir, n_steps=1000, n_indices=100, config=None):
+    """Run every (catchments, years) case.
+
+    Parameters
+    ----------
+    catchments : list of int
+        Catchment counts.
+    years : list of float
+        Lengths of the hourly series in years.
+    data_dir : str
+        Directory of the synthetic files, reused when they exist.
+    n_steps, n_indices : int, optional
+        See ``run_case``.
+    config : dict, optional
+        Extra configuration keys, e.g. ``{"Chunk_Size": 720}``.
+
+    Returns
+    -------
+    dict
+        Environment and per-case results.
+    """
+    os.makedirs(data_dir, exist_ok=True)
+    cases = []
+    for n_catchments in catchments:
+        for n_years in years:
+            n_times = int(round(n_years * 8760))
+            nc_file = os.path.join(data_dir, "forcing_" + str(n_catchments) + "x" + str(n_times) + ".nc")
+            if not os.path.exists(nc_file):
+                make_forcing_file(nc_file, n_catchments, n_times)
+
+            cfg = {"start_time_date": TIME_ORIGIN,
+                   "end_time_date": str(np.datetime64(TIME_ORIGIN.replace(" ", "T"))
+                                        + np.timedelta64(n_times, "h")).replace("T", " "),
+                   "Netcdf_File": nc_file,
+                   "Debug": 0}
+            cfg.update(config or {})
+            cfg_file = os.path.join(data_dir, "config_" + str(n_catchments) + "x" + str(n_times) + ".yaml")
+            with open(cfg_file, "w") as f:
+                yaml.safe_dump(cfg, f)
+
+            # a fresh process per case keeps the peak RSS its own
+            with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as pool:
+                result = pool.submit(run_case, cfg_file, n_steps, n_indices).result()
+            result.update({"catchments": n_catchments, "years": n_years, "times": n_times,
+                           "file_bytes": os.path.getsize(nc_file)})
+            cases.append(result)
+            print(" " + str(n_catchments) + " catchments x " + str(n_years) + " years: init "
+                  + str(round(result["initialize_seconds"], 4)) + " s, step "
+                  + str(round(result["step_seconds"] * 1e6, 2)) + " us, peak rss "
+                  + str(result["peak_rss_bytes"] // 2**20) + " MiB")
+
+    return {"commit": git_commit(),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "machine": platform.machine(),
+            "config": config or {},
+            "cases": cases}
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--catchments", type=int, nargs="+", default=[1, 100, 1000])
+    parser.add_argument("--years", type=float, nargs="+", default=[1])
+    parser.add_argument("--steps", type=int, default=1000, help="steps timed per case")
+    parser.add_argument("--indices", type=int, default=100, help="size of the gathered index set")
+    parser.add_argument("--data-dir", default=os.path.join(tempfile.gettempdir(), "forcing_benchmark"),
+                        help="directory of the synthetic forcing files")
+    parser.add_argument("--config", default=None,
+                        help="YAML of extra configuration keys, e.g. Chunk_Size")
+    parser.add_argument("--output", default="bench.json", help="JSON results file")
+    args = parser.parse_args()
+
+    config = None
+    if args.config is not None:
+        with open(args.config) as f:
+            config = yaml.safe_load(f)
+    results = run_benchmarks(args.catchments, args.years, args.data_dir,
+                             args.steps, args.indices, config)
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=1)
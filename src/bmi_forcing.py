@@ -1,11 +1,20 @@
 #! /usr/bin/env python
 """Basic Model Interface implementation for the 2D heat model."""
 
+import asyncio
+import time
 import numpy as np
 from bmipy import Bmi
+from derived_variables import DERIVED_VARIABLES, derive
+from ensemble import Perturbations
 from read_forcing_object import Forcing
+from time_axis import parse_date
 BMI_SUCCESS = 1
 
+# forcing steps of derived variables computed at once when the whole
+# window is resident
+DERIVED_BLOCK = 168
+
 class BmiForcing(Bmi):
 
     """Read Forcing"""
@@ -43,12 +52,21 @@ class BmiForcing(Bmi):
          'land_surface_radiation~incoming~longwave__energy_flux':'W m-2',
          'land_surface_air__pressure':'Pa',
          'atmosphere_air_water~vapor__relative_saturation':'kg kg-1',
-         'atmosphere_water__liquid_equivalent_precipitation_rate':'kg m-2',
+         'atmosphere_water__liquid_equivalent_precipitation_rate':'kg m-2 s-1',
          'land_surface_radiation~incoming~shortwave__energy_flux':'W m-2',
          'land_surface_air__temperature':'K',
          'land_surface_wind__x_component_of_velocity':'m s-1',
          'land_surface_wind__y_component_of_velocity':'m s-1'}    
     
+    #------------------------------------------------------
+    # Variables derived from the forcing variables, served
+    # after them (see derived_variables).
+    #------------------------------------------------------
+    _forcing_var_names = _output_var_names
+    _output_var_names = _output_var_names + tuple(DERIVED_VARIABLES)
+    _var_name_map.update((name, v.name) for name, v in DERIVED_VARIABLES.items())
+    _var_units_map.update((name, v.units) for name, v in DERIVED_VARIABLES.items())
+    
     def __init__(self):
         """Create a BmiForcing model that is ready for initialization."""
         self._model = None
@@ -65,30 +83,160 @@ class BmiForcing(Bmi):
         self._current_time_index = 0
         self._time_units = "s"
         self._time_step = 3600
+        
+        # values of the current step, one row per variable; the
+        # pointers handed out by get_value_ptr are views into it. The
+        # scratch buffer holds the decoded next forcing step when interpolating
+        self._step_values = None
+        self._scratch_values = None
+        self._value_ptrs = {}
+        
+        # derived variables are computed once their values are first
+        # requested, for a block of forcing steps at a time: the forcing
+        # steps [_derived_beg, _derived_end) of _derived, one row per active
+        # variable, filling the step buffer rows _derived_rows
+        self._inactive_derived = set(DERIVED_VARIABLES)
+        self._derived_vars = []
+        self._derived_rows = []
+        self._derived = None
+        self._derived_beg = self._derived_end = 0
+        
+        # values set through set_value*, merged into the step buffer when
+        # their time index is served: time index -> variable -> (catchment
+        # indices, values). The forcing store itself is never written
+        self._overrides = {}
+        
+        # ensemble.Perturbations generating members from the forcing, and
+        # the decoded forcing step they are generated from
+        self._ensemble = None
+        self._base_values = None
+        
+        # model steps per forcing step and, per model step within it, the
+        # weight of the next forcing step for every variable (0 when held
+        # constant)
+        self._steps_per_forcing_step = 1
+        self._interp_weights = None
+
+        # model steps from window step 0, the forcing row at or before
+        # start_time_date, to start_time_date, which is time index 0
+        self._start_index = 0
+
+        # tail mode: end time from the configuration, and when forcing
+        # files were last polled for new time steps
+        self._config_end_time_index = self._end_time_index
+        self._last_poll = 0.0
+        
+        # profiling.Profiler when the configuration enables Profile
+        self._profiler = None
+        
+        # recorder.Recorder of the served steps when Record_File is set;
+        # a step is recorded when the model leaves it, overrides included
+        self._recorder = None
 
-    def initialize(self, filename=None):
+    def initialize(self, filename=None, **overrides):
         """Initialize the Forcing model.
 
         Parameters
         ----------
         filename : str, optional
             Path to name of input file.
+        **overrides
+            Not part of BMI; configuration keys replacing those of the
+            file, e.g. ``Shared_Memory``.
         """
-        from datetime import datetime
-        
         if filename is None:
-            self._model = Forcing()
+            self._model = Forcing(**overrides)
         # elif isinstance(filename, str):
         #     with open(filename, "r") as file_obj:
         #         self._model = Forcing.read_config(file_obj.read())
         else:
-            self._model = Forcing.read_config(filename)  
+            self._model = Forcing.read_config(filename, **overrides)  
+        
+        return self._initialize_model()
+
+    async def initialize_async(self, filename=None, executor=None):
+        """Initialize the Forcing model without blocking the event loop.
+
+        The configuration is parsed and the forcing read in ``executor``
+        (the loop's default executor by default).
+
+        Parameters
+        ----------
+        filename : str, optional
+            Path to name of input file.
+        executor : concurrent.futures.Executor, optional
+            Executor running the reads.
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(executor, self.initialize, filename)
+
+    def _initialize_model(self):
+        """Read the forcing of ``_model`` and set up the step buffer."""
+        self._profiler = None
+        if self._model._Profile:
+            self._enable_profiling()
+        self._model.read_forcing()        
+        self._current_time_index = 0
+
+        forcing_step = self._model._forcing_step
+        self._time_step = int(self._model._Time_Step)
+        if self._time_step <= 0 or forcing_step % self._time_step != 0:
+            raise ValueError("Time_Step must divide the forcing step of " + str(forcing_step)
+                             + " s, got " + str(self._time_step))
+        self._steps_per_forcing_step = forcing_step // self._time_step
+        offset = self._model.start_offset() / self._time_step
+        if abs(offset - round(offset)) > 1e-6:
+            raise ValueError("start_time_date " + str(self._model._start_time_date)
+                             + " does not fall on a model time step of the forcing")
+        self._start_index = int(round(offset))
         
         #if(getattr(self._model,'_Debug')==1):print ("start time: " + str(datetime.fromisoformat(self._model._start_time_date)))    
         #if(getattr(self._model,'_Debug')==1):print ("end time:   " + str(datetime.fromisoformat(self._model._end_time_date)))
-        self._end_time_index = int((datetime.fromisoformat(self._model._end_time_date)-datetime.fromisoformat(self._model._start_time_date)).total_seconds()/3600.)
+        if self._model._end_time_date == -9:
+            self._end_time_index = self._steps_per_forcing_step
+        else:
+            self._end_time_index = int(self._model.seconds_since_start(self._model._end_time_date) / self._time_step)
         
-        self._model.read_forcing()        
+        # the end time is clamped to the forcing read; in tail mode it
+        # follows the data as it arrives
+        self._config_end_time_index = self._end_time_index
+        self._end_time_index = min(self._config_end_time_index, self._data_end_index())
+        if self._model._Tail_Interval is not None:
+            self._last_poll = time.monotonic()
+        
+        model = self._model
+        self._ensemble = self._base_values = None
+        if model._Ensemble_Members is not None or model._Perturbations:
+            if model._n_members > 1:
+                raise ValueError("the forcing file has a member dimension; Ensemble_Members"
+                                 + " and Perturbations cannot be added to it")
+            self._ensemble = Perturbations(model._Ensemble_Members or 1, model._Perturbations,
+                                           model._var_index, model._Ensemble_Seed or 0)
+        
+        # served in the decoded dtype of the store, the derived variables
+        # after the forcing variables (zero until activated)
+        n_vars = self._model._values.shape[0]
+        shape = (n_vars + len(DERIVED_VARIABLES), self.get_grid_size(0))
+        self._step_values = np.zeros(shape, dtype=self._model._value_dtype)
+        self._scratch_values = np.zeros_like(self._step_values)
+        if self._ensemble is not None:
+            self._base_values = np.empty((n_vars, len(model._catchment_ids)), dtype=model._value_dtype)
+        self._value_ptrs = {}
+        for name in self._forcing_var_names:
+            self._value_ptrs[name] = self._step_values[self._model._var_index[self._var_name_map[name]]]
+        for k, name in enumerate(DERIVED_VARIABLES):
+            self._value_ptrs[name] = self._step_values[n_vars + k]
+        self._inactive_derived = set(DERIVED_VARIABLES)
+        self._derived_vars = []
+        self._derived_rows = []
+        self._derived = None
+        self._derived_beg = self._derived_end = 0
+        self._overrides = {}
+        self._interp_weights = self._interpolation_weights()
+        self._update_step_values()
+        self._recorder = None
+        if model._Record_File is not None:
+            self._start_recording()
         
         #if(getattr(self._model,'_Debug')==1): print(getattr(self._model,'_time_series_df'))       
         return BMI_SUCCESS;       
@@ -96,10 +244,59 @@ class BmiForcing(Bmi):
     def update(self):
         """Advance model by one time step."""
         #Done - LKC        
+        if self._current_time_index >= self._data_end_index() and self._model._Tail_Interval is None:
+            raise IndexError("time index " + str(self._current_time_index + 1) + " is past the forcing,"
+                             + " which ends at time index " + str(self._data_end_index()))
+        if self._recorder is not None:
+            self._record_step()
         self._current_time_index=self._current_time_index+1
+        if self._model._Tail_Interval is not None:
+            self._poll_forcing()
+        self._update_step_values()
         
         return BMI_SUCCESS;
 
+    async def update_async(self, executor=None):
+        """Advance model by one time step without blocking the event loop.
+
+        When the step needs a chunk that is not resident, or tail mode is
+        due to poll the files, ``update`` runs in ``executor``; otherwise it
+        runs inline.
+
+        Parameters
+        ----------
+        executor : concurrent.futures.Executor, optional
+            Executor running the reads.
+        """
+        if self._needs_io(self._current_time_index + 1):
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(executor, self.update)
+        return self.update()
+
+    async def update_until_async(self, then, executor=None):
+        """Update model until a particular time, reading in ``executor``.
+
+        Parameters
+        ----------
+        then : float
+            Time to run model until.
+        executor : concurrent.futures.Executor, optional
+            Executor running the reads.
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(executor, self.update_until, then)
+
+    def _needs_io(self, index):
+        """Whether serving time index ``index`` may read forcing files."""
+        model = self._model
+        if model._Tail_Interval is not None and time.monotonic() - self._last_poll >= model._Tail_Interval:
+            return True
+        t, phase = self._forcing_step(index)
+        if t >= model._n_times:
+            return False
+        last = min(t + 1 if phase > 0 else t, model._n_times - 1)
+        return not model._values_beg <= t <= last < model._values_beg + model._values_rows
+
     def update_until(self, then):
         """Update model until a particular time.
 
@@ -109,10 +306,15 @@ class BmiForcing(Bmi):
             Time to run model until.
         """
         #Done - LKC 
-        n_steps = (then - self.get_current_time()) / self.get_time_step()
+        n_steps = int((then - self.get_current_time()) / self.get_time_step())
 
-        for _ in range(int(n_steps)):
-            self.update()
+        # jump straight to the target step, clamped to the forcing window;
+        # only the step (or chunk) landed on is loaded
+        if n_steps > 0:
+            if self._recorder is not None:
+                self._record_step()
+            self._current_time_index = min(self._current_time_index + n_steps, self._last_time_index())
+            self._update_step_values()
 
         return BMI_SUCCESS;       
         
@@ -120,9 +322,275 @@ class BmiForcing(Bmi):
     def finalize(self):
         """Finalize model."""
         #Done - LKC 
+        if self._profiler is not None:
+            if isinstance(self._model._Profile, str):
+                self._profiler.dump(self._model._Profile,
+                                    prefetch=self._model.prefetch_stats(),
+                                    load_seconds=self._model._load_seconds,
+                                    load_bytes=self._model._load_nbytes)
+            self._profiler.unwrap()
+        if self._recorder is not None:
+            self._record_step()
+            self._recorder.close()
+            self._recorder = None
+        self._model.close()
         self._model = None
+        self._step_values = None
+        self._scratch_values = None
+        self._value_ptrs = {}
+        self._derived = None
+        self._overrides = {}
+        self._base_values = None
         return BMI_SUCCESS;       
 
+    def _enable_profiling(self):
+        """Time the BMI methods of this instance and the reads of its model.
+
+        The methods are wrapped on the instances only, so an unprofiled
+        model runs the plain methods.
+        """
+        from profiling import Profiler
+
+        self._profiler = profiler = Profiler()
+        self._model.enable_profiling(profiler)
+        copied = lambda result, *args: result.nbytes
+        step = lambda result, *args: self._step_values.nbytes
+        profiler.wrap(self, "update", nbytes=step)
+        profiler.wrap(self, "update_until", nbytes=step)
+        profiler.wrap(self, "get_value_ptr")
+        profiler.wrap(self, "get_value", nbytes=copied)
+        profiler.wrap(self, "get_value_at_indices", nbytes=copied)
+        # views of the store are not copies
+        profiler.wrap(self, "get_values_for_range",
+                      nbytes=lambda result, *args: 0 if np.may_share_memory(result, self._model._values)
+                      else result.nbytes)
+        profiler.wrap(self, "set_value", nbytes=lambda result, name, src: np.asarray(src).nbytes)
+        profiler.wrap(self, "set_value_at_indices",
+                      nbytes=lambda result, name, inds, src: np.asarray(src).nbytes)
+
+    def _start_recording(self):
+        """Record the forcing variables served to ``Record_File``."""
+        from recorder import Recorder
+
+        model = self._model
+        catchment_ids = model._catchment_ids
+        if self._ensemble is not None:
+            catchment_ids = [c + "_m" + str(m) for m in range(self._ensemble.n_members) for c in catchment_ids]
+        source = model._Netcdf_File or model._Catchment_Files or model._Cache_File or model._Shared_Memory
+        self._recorder = Recorder(model._Record_File, model._vname, catchment_ids,
+                                  "seconds since " + parse_date(model._start_time_date).isoformat(sep=" "),
+                                  model._time_axis.calendar, dtype=self._step_values.dtype,
+                                  buffer_steps=model._Record_Buffer or 1024,
+                                  units=model._units, long_names=model._long_name,
+                                  attributes={"title": "Forcing served by " + self._name,
+                                              "source": str(source)})
+
+    def _record_step(self):
+        """Record the values served at the current time."""
+        self._recorder.record(self._current_time_index * self._time_step,
+                              self._step_values[:self._model._values.shape[0]])
+
+    def profile_stats(self):
+        """Call counts, latencies and bytes of the profiled methods.
+
+        Returns
+        -------
+        dict or None
+            ``profiling.Profiler.summary``, or None unless the
+            configuration sets ``Profile``.
+        """
+        if self._profiler is None:
+            return None
+        return self._profiler.summary()
+
+    def get_ensemble_size(self):
+        """Number of ensemble members served.
+
+        Not part of BMI. Members are laid out member-major on grid 0:
+        node ``m * n_catchments + c`` is catchment ``c`` of member ``m``.
+
+        Returns
+        -------
+        int
+            Members from the forcing file's member dimension or generated
+            by ``Perturbations``; 1 without an ensemble.
+        """
+        if self._ensemble is not None:
+            return self._ensemble.n_members
+        return self._model._n_members
+
+    def _poll_forcing(self):
+        """Poll the forcing files for new time steps every ``Tail_Interval`` s."""
+        now = time.monotonic()
+        if now - self._last_poll < self._model._Tail_Interval:
+            return
+        self._last_poll = now
+        if self._model.poll() > 0:
+            self._end_time_index = min(self._config_end_time_index, self._data_end_index())
+
+    def _data_end_index(self):
+        """Last time index with forcing, in the last forcing step read."""
+        return self._first_index(self._model._n_times) - 1
+
+    def _last_time_index(self):
+        """Last time index with forcing, or the current one if later."""
+        return max(self._data_end_index(), self._current_time_index)
+
+    def _forcing_step(self, index):
+        """Forcing step served at time ``index``, and the model steps into it.
+
+        On an irregular axis the row is found by bisection, and a row may
+        span more or fewer model steps than ``_steps_per_forcing_step``.
+        """
+        if self._model._time_axis.regular:
+            return divmod(index + self._start_index, self._steps_per_forcing_step)
+        t = self._model.step_at((index + self._start_index) * self._time_step)
+        return t, index - self._first_index(t)
+
+    def _first_index(self, t):
+        """First time index served forcing step ``t``.
+
+        Negative for the forcing step containing ``start_time_date`` when
+        that date falls within it.
+        """
+        if self._model._time_axis.regular:
+            return t * self._steps_per_forcing_step - self._start_index
+        return -int(-self._model.step_seconds(t) // self._time_step) - self._start_index
+
+    def _interpolation_weights(self):
+        """Weights of the next forcing step for each model step within one.
+
+        State variables are interpolated linearly. Precipitation and the
+        radiation fluxes are mean rates over the forcing step and are held
+        constant over it, which conserves their totals.
+
+        Derived variables are interpolated like their first input.
+
+        Returns
+        -------
+        ndarray
+            (model steps per forcing step x step buffer rows x 1) weights.
+        """
+        methods = {'LWDOWN': 'constant', 'PSFC': 'linear', 'Q2D': 'linear',
+                   'RAINRATE': 'constant', 'SWDOWN': 'constant', 'T2D': 'linear',
+                   'U2D': 'linear', 'V2D': 'linear'}
+        methods.update(self._model._Interpolation or {})
+        linear = np.zeros((len(self._step_values), 1), dtype=self._step_values.dtype)
+        for v, row in self._model._var_index.items():
+            if methods.get(v, 'linear') not in ('linear', 'constant'):
+                raise ValueError("unknown interpolation " + str(methods[v]) + " for " + v)
+            linear[row] = methods.get(v, 'linear') == 'linear'
+        n_vars = self._model._values.shape[0]
+        for k, variable in enumerate(DERIVED_VARIABLES.values()):
+            linear[n_vars + k] = linear[self._model._var_index[variable.inputs[0]]]
+        phase = np.arange(self._steps_per_forcing_step, dtype=linear.dtype) / self._steps_per_forcing_step
+        return phase[:, None, None] * linear
+
+    def _update_step_values(self):
+        """Decode the forcing of the current time index into the step buffer.
+
+        Between forcing steps the values are blended with the next one
+        using the precomputed weights, in one pass over all variables and
+        catchments; across a gap of an irregular axis they are held. Values
+        set for the time index are then merged in.
+        """
+        model = self._model
+        spf = self._steps_per_forcing_step
+        t, phase = self._forcing_step(self._current_time_index)
+        if t < model._n_times:
+            row = model.load_step(t)
+            step = self._step_values
+            self._decode_step(t, row, step)
+            self._fill_derived(step, t)
+            if (0 < phase < spf and t + 1 < model._n_times
+                    and self._first_index(t+1) - self._first_index(t) == spf):
+                following = self._scratch_values
+                self._decode_step(t+1, row+1 if row + 1 < model._values_rows else None, following)
+                self._fill_derived(following, t+1, lookahead=True)
+                # step += weight * (following - step)
+                delta = np.subtract(following, step, out=following)
+                delta *= self._interp_weights[phase]
+                step += delta
+        overrides = self._overrides.get(self._current_time_index)
+        if overrides:
+            for name, (indices, values) in overrides.items():
+                self._value_ptrs[name][indices] = values
+
+    def _decode_step(self, t, row, values):
+        """Set the forcing variables of forcing step ``t`` in ``values``.
+
+        Parameters
+        ----------
+        t : int
+            Forcing step.
+        row : int or None
+            Row of step ``t`` in the store, None for the step after the
+            resident chunk.
+        values : ndarray
+            Step buffer, whose members are generated from the step when
+            perturbing an ensemble.
+        """
+        model = self._model
+        forcing = values[:model._values.shape[0]]
+        dest = forcing if self._ensemble is None else self._base_values
+        if row is None:
+            dest[...] = model.lookahead(t)
+        else:
+            model.decode(model._values[:, row], dest)
+        if self._ensemble is not None:
+            self._ensemble.perturb(dest, t, forcing)
+
+    def _fill_derived(self, values, t, lookahead=False):
+        """Set the active derived variables of forcing step ``t`` in ``values``.
+
+        They are computed for the whole resident chunk (or a block of
+        ``DERIVED_BLOCK`` steps when the window is loaded at once) and kept
+        until a step outside it is served; those of generated ensemble
+        members, and of a look-ahead step outside the block, are computed
+        from the step alone.
+
+        Parameters
+        ----------
+        values : ndarray
+            Step buffer whose forcing rows hold step ``t``.
+        t : int
+            Forcing step.
+        lookahead : bool, optional
+            Whether step ``t`` is only interpolated towards, in which case
+            the cached block is kept.
+        """
+        if not self._derived_rows:
+            return
+        model = self._model
+        if not self._derived_beg <= t < self._derived_end:
+            beg = model._values_beg
+            end = beg + model._values_rows
+            if self._ensemble is not None or lookahead or not beg <= t < end:
+                # members, and the step after a block, derived on their own
+                forcing = values[:len(model._var_index), None]
+                values[self._derived_rows] = derive(self._derived_vars, model._var_index, forcing)[:, 0]
+                return
+            if model._Chunk_Size is None:
+                beg = t - t % DERIVED_BLOCK
+                end = min(beg + DERIVED_BLOCK, end)
+            out = self._derived
+            if out is None or out.shape[1] != end - beg:
+                out = None
+            self._derived = derive(self._derived_vars, model._var_index,
+                                   model.values_for_range(beg, end), out=out)
+            self._derived_beg, self._derived_end = beg, end
+        values[self._derived_rows] = self._derived[:, t - self._derived_beg]
+
+    def _activate_derived(self, var_name):
+        """Start computing derived variable ``var_name`` at every step."""
+        self._inactive_derived.discard(var_name)
+        self._derived_vars.append(DERIVED_VARIABLES[var_name])
+        self._derived_rows.append(self._model._values.shape[0] + list(DERIVED_VARIABLES).index(var_name))
+        # the cached block lacks the new variable
+        self._derived = None
+        self._derived_beg = self._derived_end = 0
+        self._update_step_values()
+
     #-------------------------------------------------------------------
     # BMI: Variable Information Functions
     #-------------------------------------------------------------------
@@ -147,10 +615,82 @@ class BmiForcing(Bmi):
         array_like
             Value array.
         """
-        #print(self._var_name_map[var_name])
-        #print("This is the current time " + str(self._current_time_index))
-        return getattr(self._model,'_time_series_df')[self._var_name_map[var_name]].iloc[self._current_time_index]
+        if var_name in self._inactive_derived:
+            self._activate_derived(var_name)
+        return self._value_ptrs[var_name]
     
+    def get_values_for_range(self, start, stop, var_names=None, advance=False):
+        """Values of several variables over a range of time steps.
+
+        Not part of BMI; lets a coupled model that integrates several steps
+        internally fetch them in one call instead of one ``update`` and
+        ``get_value`` per variable and step.
+
+        Parameters
+        ----------
+        start, stop : int
+            Indices of the first and one past the last forcing step; the
+            same as ``get_current_time`` when the model step is the
+            forcing step.
+        var_names : list of str, optional
+            CSDMS Standard Names, all forcing (not derived) variables by
+            default.
+        advance : bool, optional
+            Move the current time to forcing step ``stop`` (clamped to the
+            last step).
+
+        Returns
+        -------
+        ndarray
+            (n_vars x n_steps x n_catchments) array. It is a read-only view
+            of the forcing store when the steps are resident, the store is
+            not packed, the variables are forcing variables evenly spaced
+            in it (as the default ones are), no value was set for these
+            steps and no ensemble is generated, otherwise a copy. Nodes are
+            laid out as by ``get_value``.
+        """
+        if var_names is None:
+            var_names = self._forcing_var_names
+        forcing = None
+        if self._ensemble is not None:
+            forcing = self._ensemble.perturb_range(self._model.values_for_range(start, stop), start)
+        derived = [DERIVED_VARIABLES[name] for name in var_names if name in DERIVED_VARIABLES]
+        if derived:
+            if forcing is None:
+                forcing = self._model.values_for_range(start, stop)
+            derived = iter(derive(derived, self._model._var_index, forcing))
+            values = np.stack([next(derived) if name in DERIVED_VARIABLES
+                               else forcing[self._model._var_index[self._var_name_map[name]]]
+                               for name in var_names])
+        else:
+            rows = [self._model._var_index[self._var_name_map[name]] for name in var_names]
+            step = rows[1] - rows[0] if len(rows) > 1 else 1
+            if step > 0 and rows == list(range(rows[0], rows[-1]+1, step)):
+                rows = slice(rows[0], rows[-1]+1, step)
+            if forcing is None:
+                forcing = self._model.values_for_range(start, stop)
+            values = forcing[rows]
+
+        # values set for these steps are merged into a copy
+        steps = []
+        for index in self._overrides:
+            t, phase = self._forcing_step(index)
+            if phase == 0 and start <= t < stop:
+                steps.append((index, t))
+        if steps:
+            values = np.array(values)
+            position = {name: i for i, name in enumerate(var_names)}
+            for index, t in steps:
+                for name, (indices, set_values) in self._overrides[index].items():
+                    if name in position:
+                        values[position[name], t - start, indices] = set_values
+        if advance:
+            if self._recorder is not None:
+                self._record_step()
+            self._current_time_index = min(max(self._first_index(stop), 0), self._last_time_index())
+            self._update_step_values()
+        return values
+
     def get_var_type(self, var_name):
         """Data type of variable.
 
@@ -162,9 +702,9 @@ class BmiForcing(Bmi):
         Returns
         -------
         str
-            Data type.
+            Data type of the values served, float32 for a packed store.
         """
-        return str(self.get_value_ptr(var_name).dtype)
+        return str(self._value_ptrs[var_name].dtype)
 
     def get_var_units(self, var_name):
         """Get units of variable.
@@ -194,7 +734,7 @@ class BmiForcing(Bmi):
         int
             Size of data array in bytes.
         """
-        return self.get_value_ptr(var_name).nbytes
+        return self._value_ptrs[var_name].nbytes
 
     def get_var_itemsize(self, name):
         return np.dtype(self.get_var_type(name)).itemsize
@@ -258,9 +798,11 @@ class BmiForcing(Bmi):
         int
             Size of grid.
         """
-       # 0 is the only id we have
+       # 0 is the only id we have, one node per catchment and member
         if grid_id == 0:
-            return 1
+            if self._ensemble is not None:
+                return len(self._model._catchment_ids) * self._ensemble.n_members
+            return len(self._model._catchment_ids)
 
 
     def get_value(self, var_name, dest):
@@ -278,7 +820,9 @@ class BmiForcing(Bmi):
         array_like
             Copy of values.
         """
-        dest[:] = self.get_value_ptr(var_name).flatten()
+        if var_name in self._inactive_derived:
+            self._activate_derived(var_name)
+        dest[:] = self._value_ptrs[var_name]
         return dest
     # def get_value(self, var_name):
     
@@ -315,11 +859,16 @@ class BmiForcing(Bmi):
         array_like
             Values at indices.
         """
-        dest[:] = self.get_value_ptr(var_name).take(indices)
+        if var_name in self._inactive_derived:
+            self._activate_derived(var_name)
+        dest[:] = self._value_ptrs[var_name].take(np.asarray(indices, dtype=np.intp))
         return dest
 
     def set_value(self, var_name, value):
-        """Set model values.
+        """Set model values at the current time.
+
+        The values override the forcing for the current time index only;
+        the forcing store is not modified.
 
         Parameters
         ----------
@@ -328,15 +877,10 @@ class BmiForcing(Bmi):
         value : array_like
             Array of new values.
         """
-        # from csdms example:
-        # val = self.get_value_ptr(var_name)
-        # val[0] = src
-        
-        var_name = self.get_var_name( var_name )
-        setattr( self, var_name, value )
+        self.set_value_at_time(var_name, self._current_time_index, value)
 
     def set_value_at_indices(self, name, inds, src):
-        """Set model values at particular indices.
+        """Set model values at particular indices at the current time.
 
         Parameters
         ----------
@@ -347,8 +891,67 @@ class BmiForcing(Bmi):
         indices : array_like
             Array of indices.
         """
-        val = self.get_value_ptr(name)
-        val.flat[inds] = src
+        self.set_value_at_time(name, self._current_time_index, src, inds)
+
+    def set_value_at_time(self, var_name, time_index, src, indices=None):
+        """Override the values of a variable at any time index.
+
+        Not part of BMI; lets data assimilation or nudging set forcing
+        ahead of (or behind) the current time. The values are kept in a
+        sparse overlay merged into the served values of that time index,
+        by ``get_value_ptr``, ``get_value`` and ``get_values_for_range``.
+        Overriding a forcing variable does not change the variables
+        derived from it.
+
+        Parameters
+        ----------
+        var_name : str
+            Name of variable as CSDMS Standard Name.
+        time_index : int
+            Time index, as ``get_current_time``.
+        src : array_like
+            New values, one per index (or a single one for all).
+        indices : array_like, optional
+            Catchment indices, all by default.
+        """
+        n = self.get_grid_size(0)
+        if var_name not in self._value_ptrs:
+            raise KeyError(var_name)
+        if indices is None:
+            indices = np.arange(n)
+        indices = np.asarray(indices, dtype=np.intp).reshape(-1)
+        if np.any((indices < 0) | (indices >= n)):
+            raise IndexError("catchment indices must be in [0, " + str(n) + ")")
+        values = np.array(src, dtype=self._step_values.dtype).reshape(-1)
+        if values.size == 1:
+            values = np.repeat(values, len(indices))
+        elif values.size != len(indices):
+            raise ValueError("got " + str(values.size) + " values for " + str(len(indices)) + " indices")
+
+        overrides = self._overrides.setdefault(int(time_index), {})
+        if var_name in overrides:
+            # later values replace earlier ones at the same indices
+            previous_indices, previous_values = overrides[var_name]
+            keep = ~np.isin(previous_indices, indices)
+            indices = np.concatenate([previous_indices[keep], indices])
+            values = np.concatenate([previous_values[keep], values])
+        overrides[var_name] = (indices, values)
+        if time_index == self._current_time_index:
+            self._value_ptrs[var_name][indices] = values
+
+    def clear_overrides(self, before=None):
+        """Drop the values set with ``set_value*``.
+
+        Parameters
+        ----------
+        before : int, optional
+            Only drop those of time indices before this one.
+        """
+        if before is None:
+            self._overrides = {}
+        else:
+            self._overrides = {index: o for index, o in self._overrides.items() if index >= before}
+        self._update_step_values()
 
     def get_component_name(self):
         """Name of the component."""
@@ -381,8 +984,11 @@ class BmiForcing(Bmi):
 
     def get_grid_type(self, grid_id):
         """Type of grid."""
+        # a single catchment is a scalar, several form an unstructured grid
         if grid_id == 0:
-            return "scalar"
+            if self.get_grid_size(grid_id) == 1:
+                return "scalar"
+            return "unstructured"
 
     def get_start_time(self):
         """Start time of model."""
@@ -414,7 +1020,7 @@ class BmiForcing(Bmi):
         raise NotImplementedError("get_grid_face_nodes")
 
     def get_grid_node_count(self, grid):
-        raise NotImplementedError("get_grid_node_count")
+        return self.get_grid_size(grid)
 
     def get_grid_nodes_per_face(self, grid, nodes_per_face):
         raise NotImplementedError("get_grid_nodes_per_face")
@@ -433,4 +1039,40 @@ class BmiForcing(Bmi):
 
 
 
-    
\ No newline at end of file
+    
+
+
+async def initialize_many(filenames, max_concurrency=4, executor=None):
+    """Initialize one BmiForcing per configuration, a few at a time.
+
+    Parameters
+    ----------
+    filenames : list of str
+        Configuration files, e.g. one per catchment.
+    max_concurrency : int, optional
+        Maximum number of configurations loading at once.
+    executor : concurrent.futures.Executor, optional
+        Executor running the reads, the loop's default executor by default.
+
+    Returns
+    -------
+    list of BmiForcing
+        Initialized models, in the order of ``filenames``. If any fails,
+        the others are finalized and its exception is raised.
+    """
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def initialize(filename):
+        async with semaphore:
+            bmi = BmiForcing()
+            await bmi.initialize_async(filename, executor)
+            return bmi
+
+    results = await asyncio.gather(*[initialize(f) for f in filenames], return_exceptions=True)
+    errors = [r for r in results if isinstance(r, BaseException)]
+    if errors:
+        for r in results:
+            if isinstance(r, BmiForcing):
+                r.finalize()
+        raise errors[0]
+    return results
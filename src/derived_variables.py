@@ -0,0 +1,91 @@
+"""Variables derived from the raw forcing variables.
+
+Every entry of ``DERIVED_VARIABLES`` maps a CSDMS Standard Name served by
+``BmiForcing`` to the forcing variables it is computed from and a NumPy
+function computing it for a whole block of time steps at once:
+
+    compute(*inputs, out=out)
+
+where ``inputs`` are (n_times x n_catchments) arrays of the ``inputs``
+variables, in that order, and ``out`` the array to fill. Values between
+forcing steps are interpolated like the first input.
+"""
+
+from collections import namedtuple
+
+import numpy as np
+
+DerivedVariable = namedtuple("DerivedVariable", ["name", "units", "inputs", "compute"])
+
+
+def precipitation_mm_per_hour(rainrate, out):
+    """Precipitation rate in mm h-1 from kg m-2 s-1 (mm s-1)."""
+    return np.multiply(rainrate, 3600., out=out)
+
+
+def wind_speed(u, v, out):
+    """Wind speed from its x and y components."""
+    return np.hypot(u, v, out=out)
+
+
+def relative_humidity(q, t, p, out):
+    """Relative humidity (0-1) from specific humidity, temperature and pressure.
+
+    Vapour pressure ``q p / (0.622 + 0.378 q)`` over the saturation vapour
+    pressure of Bolton (1980), ``611.2 exp(17.67 (T - 273.15) / (T - 29.65))``.
+    """
+    saturation = np.subtract(t, 273.15)
+    saturation *= 17.67
+    saturation /= t - 29.65
+    np.exp(saturation, out=saturation)
+    saturation *= 611.2
+    vapour = np.multiply(q, p)
+    vapour /= 0.622 + 0.378 * q
+    np.divide(vapour, saturation, out=out)
+    return np.clip(out, 0., 1., out=out)
+
+
+def celsius(t, out):
+    """Temperature in degrees Celsius from Kelvin."""
+    return np.subtract(t, 273.15, out=out)
+
+
+DERIVED_VARIABLES = {
+    "atmosphere_water__precipitation_leq-volume_flux":
+        DerivedVariable("RAINRATE_MM_H", "mm h-1", ("RAINRATE",), precipitation_mm_per_hour),
+    "land_surface_wind__speed":
+        DerivedVariable("WIND_SPEED", "m s-1", ("U2D", "V2D"), wind_speed),
+    # Q2D, specific humidity, is served under the CSDMS name of relative
+    # humidity (atmosphere_air_water~vapor__relative_saturation), kept for
+    # existing models; relative humidity is served under another name
+    "land_surface_air__relative_humidity":
+        DerivedVariable("RH2D", "1", ("Q2D", "T2D", "PSFC"), relative_humidity),
+    "land_surface_air__celsius_temperature":
+        DerivedVariable("T2D_C", "degC", ("T2D",), celsius),
+}
+
+
+def derive(variables, var_index, values, out=None):
+    """Compute derived variables over a block of forcing.
+
+    Parameters
+    ----------
+    variables : list of DerivedVariable
+        Variables to compute.
+    var_index : dict
+        Row of every forcing variable in ``values``.
+    values : ndarray
+        (n_vars x n_times x n_catchments) decoded forcing.
+    out : ndarray, optional
+        (len(variables) x n_times x n_catchments) destination.
+
+    Returns
+    -------
+    ndarray
+        One (n_times x n_catchments) block per derived variable.
+    """
+    if out is None:
+        out = np.empty((len(variables),) + values.shape[1:], dtype=values.dtype)
+    for k, variable in enumerate(variables):
+        variable.compute(*[values[var_index[v]] for v in variable.inputs], out=out[k])
+    return out
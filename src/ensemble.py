@@ -0,0 +1,114 @@
+"""Ensemble members generated by perturbing the forcing.
+
+Members are not stored: every forcing step is broadcast to all members
+and perturbed with normal deviates drawn from a generator seeded with
+``(seed, step)``, so any step of any member can be regenerated in any
+order and memory grows with the perturbed variables, not the members:
+
+    perturbations = Perturbations(50, {"RAINRATE": {"multiplicative": 0.3},
+                                       "T2D": {"additive": 0.5}}, var_index)
+    perturbations.perturb(step_values, t, out)   # (n_vars x 50*n_cats)
+
+``additive: s`` adds ``s z``; ``multiplicative: s`` multiplies by the
+mean-one lognormal factor ``exp(s z - s**2/2)``, which keeps
+precipitation and radiation non-negative. Member 0 is the unperturbed
+control. Members are laid out member-major, node ``m*n_cats + c`` being
+catchment ``c`` of member ``m``.
+"""
+
+import numpy as np
+
+RULES = ("additive", "multiplicative")
+
+
+class Perturbations(object):
+
+    """Seeded per-variable perturbations of ensemble members."""
+
+    def __init__(self, n_members, rules, var_index, seed=0):
+        """Create the perturbations of ``n_members`` members.
+
+        Parameters
+        ----------
+        n_members : int
+            Number of members, the control included.
+        rules : dict
+            ``{variable: {"additive" or "multiplicative": std}}``.
+        var_index : dict
+            Row of every forcing variable.
+        seed : int, optional
+            Seed of the deviates.
+        """
+        self.n_members = int(n_members)
+        if self.n_members < 1:
+            raise ValueError("Ensemble_Members must be at least 1, got " + str(n_members))
+        self.seed = int(seed)
+        self._rows = []
+        self._std = []
+        self._multiplicative = []
+        for v, rule in (rules or {}).items():
+            if v not in var_index:
+                raise ValueError("cannot perturb unknown variable " + str(v))
+            if len(rule) != 1 or next(iter(rule)) not in RULES:
+                raise ValueError("perturbation of " + v + " must be one of " + ", ".join(RULES))
+            kind, std = next(iter(rule.items()))
+            self._rows.append(var_index[v])
+            self._std.append(float(std))
+            self._multiplicative.append(kind == "multiplicative")
+
+    def perturb(self, values, t, out):
+        """Members of one forcing step.
+
+        Parameters
+        ----------
+        values : ndarray
+            (n_vars x n_cats) forcing of step ``t``.
+        t : int
+            Forcing step, seeding its deviates.
+        out : ndarray
+            (n_vars x n_members*n_cats) destination.
+
+        Returns
+        -------
+        ndarray
+            ``out``.
+        """
+        n_vars, n_cats = values.shape
+        members = out.reshape(n_vars, self.n_members, n_cats)
+        members[:] = values[:, None, :]
+        if self._rows and self.n_members > 1:
+            rng = np.random.default_rng([self.seed, int(t)])
+            dtype = np.float32 if out.dtype == np.float32 else np.float64
+            deviates = rng.standard_normal((len(self._rows), self.n_members - 1, n_cats), dtype=dtype)
+            for z, row, std, multiplicative in zip(deviates, self._rows, self._std, self._multiplicative):
+                z *= std
+                if multiplicative:
+                    z -= std * std / 2
+                    np.exp(z, out=z)
+                    members[row, 1:] *= z
+                else:
+                    members[row, 1:] += z
+        return out
+
+    def perturb_range(self, values, beg, out=None):
+        """Members of consecutive forcing steps.
+
+        Parameters
+        ----------
+        values : ndarray
+            (n_vars x n_steps x n_cats) forcing of steps ``beg`` onwards.
+        beg : int
+            Forcing step of the first step.
+        out : ndarray, optional
+            (n_vars x n_steps x n_members*n_cats) destination.
+
+        Returns
+        -------
+        ndarray
+            Members of every step.
+        """
+        if out is None:
+            out = np.empty(values.shape[:2] + (self.n_members * values.shape[2],), dtype=values.dtype)
+        for k in range(values.shape[1]):
+            self.perturb(values[:, k], beg + k, out[:, k])
+        return out
@@ -0,0 +1,292 @@
+"""Pre-packed binary forcing cache.
+
+A cache file holds the forcing of one or many NetCDF inputs as a single
+C-ordered (n_vars x n_times x n_catchments) array behind a small JSON
+header, so that ``Forcing`` can memory-map it instead of decoding NetCDF:
+
+    8 bytes   magic, b"FRCCACHE"
+    4 bytes   header length, little-endian uint32
+    n bytes   JSON header, padded with spaces to a 64 byte boundary
+    ...       raw little-endian array data
+
+The header records the dtype and shape of the array, the time units and
+calendar of its first row and its time step (or, for an irregular time
+axis, the time of every row), the variable names, long names and units and the
+catchment ids of its columns, and for an int16 packed store the
+per-variable ``scale_factor`` and ``add_offset``.
+
+Build a cache with
+
+    python forcing_cache.py cache.frc data/cat-3872.nc [more.nc ...]
+"""
+
+import glob
+import json
+import os
+import struct
+import numpy as np
+
+MAGIC = b"FRCCACHE"
+ALIGN = 64
+
+
+def pack_header(header):
+    """Encode a cache header, padded so the data that follows is aligned.
+
+    Parameters
+    ----------
+    header : dict
+        Cache header.
+
+    Returns
+    -------
+    bytes
+        Magic, length and JSON text.
+    """
+    text = json.dumps(header).encode()
+    size = len(MAGIC) + 4 + len(text)
+    text += b" " * (-size % ALIGN)
+    return MAGIC + struct.pack("<I", len(text)) + text
+
+
+def unpack_header(buf):
+    """Decode the header at the start of a cache buffer.
+
+    Parameters
+    ----------
+    buf : bytes-like
+        Start of a cache file or shared memory segment.
+
+    Returns
+    -------
+    tuple of (dict, int)
+        Header and offset of the array data.
+    """
+    if bytes(buf[:len(MAGIC)]) != MAGIC:
+        raise ValueError("not a forcing cache")
+    (length,) = struct.unpack("<I", bytes(buf[len(MAGIC):len(MAGIC)+4]))
+    offset = len(MAGIC) + 4 + length
+    return json.loads(bytes(buf[len(MAGIC)+4:offset])), offset
+
+
+def forcing_header(forcing, values):
+    """Header describing ``values`` laid out like the store of ``forcing``.
+
+    Parameters
+    ----------
+    forcing : Forcing
+        Forcing the values were read by.
+    values : ndarray
+        (n_vars x n_times x n_catchments) array starting at the forcing's
+        ``start_time_date``.
+    """
+    header = {
+        "version": 2,
+        "dtype": values.dtype.newbyteorder("<").str,
+        "shape": list(values.shape),
+        "time_units": "seconds since " + forcing.window_start().isoformat(sep=" "),
+        "time_calendar": forcing._time_axis.calendar,
+        "variables": list(forcing._vname),
+        "long_name": list(forcing._long_name),
+        "units": list(forcing._units),
+        "catchment_ids": list(forcing._catchment_ids),
+    }
+    if forcing._time_axis.regular:
+        header["time_step"] = forcing._forcing_step
+    else:
+        header["time_values"] = forcing.window_times()[:values.shape[1]].tolist()
+    if forcing._scale is not None:
+        # packed values, decoded as values * scale_factor + add_offset
+        header["scale_factor"] = forcing._scale.tolist()
+        header["add_offset"] = forcing._offset.tolist()
+    if forcing._n_members > 1:
+        header["n_members"] = forcing._n_members
+    return header
+
+
+def write_cache(filename, header, values):
+    """Write a cache file.
+
+    Parameters
+    ----------
+    filename : str
+        Path of the cache file.
+    header : dict
+        Cache header, see ``forcing_header``.
+    values : ndarray
+        Array to store.
+    """
+    with open(filename, "wb") as f:
+        f.write(pack_header(header))
+        f.write(np.ascontiguousarray(values, dtype=header["dtype"]).tobytes())
+
+
+def open_cache(filename):
+    """Memory-map a cache file read-only.
+
+    Parameters
+    ----------
+    filename : str
+        Path of the cache file.
+
+    Returns
+    -------
+    tuple of (dict, numpy.memmap)
+        Header and (n_vars x n_times x n_catchments) array.
+    """
+    with open(filename, "rb") as f:
+        start = f.read(len(MAGIC) + 4)
+        (length,) = struct.unpack("<I", start[len(MAGIC):])
+        header, offset = unpack_header(start + f.read(length))
+    values = np.memmap(filename, dtype=header["dtype"], mode="r",
+                       offset=offset, shape=tuple(header["shape"]))
+    return header, values
+
+
+def open_buffer(buf):
+    """View a cache laid out in memory, e.g. a shared memory segment.
+
+    Parameters
+    ----------
+    buf : buffer
+        Cache bytes.
+
+    Returns
+    -------
+    tuple of (dict, ndarray)
+        Header and read-only (n_vars x n_times x n_catchments) array.
+    """
+    header, offset = unpack_header(buf)
+    shape = tuple(header["shape"])
+    values = np.frombuffer(buf, dtype=header["dtype"], count=int(np.prod(shape)),
+                           offset=offset).reshape(shape)
+    return header, values
+
+
+def publish(header, values, name=None):
+    """Copy a cache into a new shared memory segment.
+
+    The caller owns the segment and has to ``close`` and ``unlink`` it.
+
+    Parameters
+    ----------
+    header : dict
+        Cache header, see ``forcing_header``.
+    values : ndarray
+        Array to share.
+    name : str, optional
+        Segment name, chosen by the system by default.
+
+    Returns
+    -------
+    multiprocessing.shared_memory.SharedMemory
+        The segment.
+    """
+    from multiprocessing.shared_memory import SharedMemory
+
+    head = pack_header(header)
+    shm = SharedMemory(name=name, create=True, size=len(head) + values.nbytes)
+    shm.buf[:len(head)] = head
+    shape = tuple(header["shape"])
+    dest = np.ndarray(shape, dtype=header["dtype"], buffer=shm.buf, offset=len(head))
+    dest[:] = values
+    del dest
+    return shm
+
+
+def attach_shared_memory(name):
+    """Attach to a segment created by ``publish`` without taking ownership.
+
+    Parameters
+    ----------
+    name : str
+        Segment name.
+
+    Returns
+    -------
+    multiprocessing.shared_memory.SharedMemory
+        The segment; ``close`` it when done, never ``unlink``.
+    """
+    import sys
+    from multiprocessing.shared_memory import SharedMemory
+
+    if sys.version_info >= (3, 13):
+        return SharedMemory(name=name, track=False)
+    # older versions register every attach with the resource tracker,
+    # which would unlink the segment when this process exits; keep the
+    # attach out of it (unregistering afterwards would also drop the
+    # creator's entry when the tracker is shared with a forked parent)
+    from multiprocessing import resource_tracker
+
+    register = resource_tracker.register
+    resource_tracker.register = lambda name, rtype: None
+    try:
+        return SharedMemory(name=name)
+    finally:
+        resource_tracker.register = register
+
+
+def build_cache(filename, netcdf_files, start_time_date=None, end_time_date=None,
+                storage_precision=None):
+    """Convert forcing NetCDF files into one cache file.
+
+    Parameters
+    ----------
+    filename : str
+        Path of the cache file to write.
+    netcdf_files : str or list of str
+        An existing forcing file, or per-catchment files (list, glob
+        pattern or directory) as accepted by
+        ``Forcing(Catchment_Files=...)``.
+    start_time_date, end_time_date : str, optional
+        Window to store, the whole time axis of the files by default.
+    storage_precision : str, optional
+        ``float32``, ``float64`` or ``int16`` (packed), as the
+        ``Storage_Precision`` of ``Forcing``; the dtype of the files by
+        default.
+
+    Returns
+    -------
+    dict
+        Header of the written cache.
+    """
+    from netcdf_pool import netcdf_lock, pool
+    from read_forcing_object import Forcing
+
+    if isinstance(netcdf_files, str) and os.path.isfile(netcdf_files) and not glob.has_magic(netcdf_files):
+        forcing = Forcing(Netcdf_File=netcdf_files)
+        first = netcdf_files
+    else:
+        forcing = Forcing(Catchment_Files=netcdf_files)
+        first = forcing._forcing_files()[0][0]
+    if start_time_date is None or end_time_date is None:
+        with netcdf_lock:
+            axis = pool.metadata(first)["time_axis"]
+        start_time_date = start_time_date or axis.date(0).isoformat(sep=" ")
+        end_time_date = end_time_date or axis.date(len(axis)).isoformat(sep=" ")
+    forcing._start_time_date = start_time_date
+    forcing._end_time_date = end_time_date
+    forcing._Storage_Precision = storage_precision
+    forcing.read_forcing()
+    header = forcing_header(forcing, forcing._values)
+    write_cache(filename, header, forcing._values)
+    return header
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Build a binary forcing cache.")
+    parser.add_argument("cache_file", help="cache file to write")
+    parser.add_argument("netcdf_files", nargs="+",
+                        help="forcing file, or per-catchment files, glob or directory")
+    parser.add_argument("--start", default=None, help="first date to store")
+    parser.add_argument("--end", default=None, help="end date of the stored window")
+    parser.add_argument("--precision", default=None, choices=["float32", "float64", "int16"],
+                        help="storage precision, the dtype of the files by default")
+    args = parser.parse_args()
+
+    files = args.netcdf_files
+    build_cache(args.cache_file, files[0] if len(files) == 1 else files,
+                start_time_date=args.start, end_time_date=args.end,
+                storage_precision=args.precision)
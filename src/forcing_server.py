@@ -0,0 +1,157 @@
+"""Serve forcing to the BMI processes of a node from shared memory.
+
+The server reads every distinct forcing source of its configurations
+once, for the union of their time windows, and publishes it as a shared
+memory segment named after the source:
+
+    python forcing_server.py cfg1.yaml cfg2.yaml ...
+
+Model processes whose configuration sets ``Forcing_Server: 1`` derive the
+same name from their own source keys and attach to the segment instead
+of reading the files, so the forcing is held once per node however many
+processes use it. The segments are removed when the server is stopped
+(Ctrl-C or SIGTERM).
+"""
+
+import hashlib
+import json
+import os
+import signal
+import sys
+import time
+from datetime import datetime, timedelta
+
+import yaml
+from forcing_cache import forcing_header, publish
+from read_forcing_object import Forcing
+
+# configuration keys that select the forcing data, as opposed to the window
+SOURCE_KEYS = ("Netcdf_File", "Catchment_Files", "Catchment_IDs",
+               "Catchment_Polygons", "Weight_File", "Storage_Precision", "Packing")
+
+
+def source_key(config):
+    """Hashable key of the forcing data a configuration reads."""
+    key = []
+    for k in SOURCE_KEYS:
+        v = config.get(k)
+        if isinstance(v, dict):
+            v = json.dumps(v, sort_keys=True)
+        key.append(tuple(v) if isinstance(v, list) else v)
+    return tuple(key)
+
+
+def window(config):
+    """Start and end datetimes of the window of a configuration."""
+    start = datetime.fromisoformat(config["start_time_date"])
+    if config["end_time_date"] == -9:
+        return start, start + timedelta(hours=1)
+    return start, datetime.fromisoformat(config["end_time_date"])
+
+
+def segment_name(config):
+    """Shared memory name of the forcing source of a configuration.
+
+    File paths are made absolute, so processes started from different
+    directories agree on the name.
+
+    Parameters
+    ----------
+    config : dict
+        Configuration, or at least its ``SOURCE_KEYS``.
+
+    Returns
+    -------
+    str
+        Segment name, short enough for every POSIX system.
+    """
+    source = {}
+    for k in SOURCE_KEYS:
+        v = config.get(k)
+        if k in ("Netcdf_File", "Catchment_Files", "Catchment_Polygons", "Weight_File") and v is not None:
+            v = os.path.abspath(v) if isinstance(v, str) else [os.path.abspath(p) for p in v]
+        source[k] = v
+    digest = hashlib.sha1(json.dumps(source, sort_keys=True).encode()).hexdigest()
+    return "forcing_" + digest[:16]
+
+
+def share_sources(configs, named=False):
+    """Load every distinct forcing source once into shared memory.
+
+    Parameters
+    ----------
+    configs : list of dict
+        Parsed configurations.
+    named : bool, optional
+        Name the segments with ``segment_name`` so that clients can find
+        them, instead of letting the system choose.
+
+    Returns
+    -------
+    dict
+        ``source_key`` to SharedMemory segment. Configurations without a
+        NetCDF source (e.g. a ``Cache_File``) are left out.
+    """
+    groups = {}
+    for config in configs:
+        if config.get("Cache_File") is not None or config.get("Shared_Memory") is not None:
+            continue
+        groups.setdefault(source_key(config), (config, []))[1].append(window(config))
+
+    segments = {}
+    try:
+        for key, (config, windows) in groups.items():
+            start = min(w[0] for w in windows)
+            end = max(w[1] for w in windows)
+            forcing = Forcing(start_time_date=str(start), end_time_date=str(end), Debug=0,
+                              **{k: config.get(k) for k in SOURCE_KEYS})
+            forcing.read_forcing()
+            segments[key] = publish(forcing_header(forcing, forcing._values), forcing._values,
+                                    name=segment_name(config) if named else None)
+            forcing.close()
+    except BaseException:
+        for shm in segments.values():
+            shm.close()
+            shm.unlink()
+        raise
+    return segments
+
+
+def serve(cfg_files):
+    """Publish the forcing of configurations until interrupted.
+
+    Parameters
+    ----------
+    cfg_files : list of str
+        Configuration files of the clients to serve.
+    """
+    configs = []
+    for cfg_file in cfg_files:
+        with open(cfg_file) as f:
+            configs.append(yaml.safe_load(f))
+
+    segments = share_sources(configs, named=True)
+    # SIGTERM unwinds like Ctrl-C, so the segments are unlinked
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        for shm in segments.values():
+            print(" serving " + shm.name + " (" + str(shm.size // 2**20) + " MiB)", flush=True)
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for shm in segments.values():
+            shm.close()
+            shm.unlink()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0],
+                                     fromfile_prefix_chars="@")
+    parser.add_argument("configs", nargs="+", help="configuration files of the clients")
+    args = parser.parse_args()
+
+    serve(args.configs)
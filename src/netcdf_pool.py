@@ -0,0 +1,169 @@
+"""Process-wide pool of open NetCDF files and their metadata.
+
+Opening a forcing file parses its HDF5 metadata, and every ``Forcing``
+instance of a multi-catchment or calibration run would otherwise open the
+same files again. The pool keeps a bounded number of ``netCDF4.Dataset``
+handles open, closing the least recently used one when full, and caches
+the metadata ``Forcing`` needs (time axis, catchment ids, variable
+attributes) by path, modification time and size, so a file that has not
+changed is never parsed twice.
+
+HDF5 is not thread-safe: callers hold ``netcdf_lock`` while using the pool
+or any dataset it returns.
+"""
+
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from time_axis import TimeAxis
+
+netcdf_lock = threading.RLock()
+
+
+class DatasetPool(object):
+
+    """Bounded LRU of open datasets plus a metadata cache."""
+
+    def __init__(self, max_open=64):
+        self.max_open = max_open
+        self._datasets = OrderedDict()
+        self._metadata = {}
+        self.opens = 0
+        self.hits = 0
+
+    def _stamp(self, path):
+        stat = os.stat(path)
+        return stat.st_mtime_ns, stat.st_size
+
+    def open(self, path):
+        """Open dataset of ``path``, reused while the file is unchanged.
+
+        Parameters
+        ----------
+        path : str
+            NetCDF file.
+
+        Returns
+        -------
+        netCDF4.Dataset
+            Dataset with auto-masking off; do not close it.
+        """
+        import netCDF4 as netcdf
+
+        path = os.path.abspath(path)
+        stamp = self._stamp(path)
+        entry = self._datasets.pop(path, None)
+        if entry is not None and entry[0] != stamp:
+            entry[1].close()
+            entry = None
+        if entry is None:
+            while len(self._datasets) >= max(int(self.max_open), 1):
+                self._datasets.popitem(last=False)[1][1].close()
+            nc = netcdf.Dataset(path)
+            nc.set_auto_mask(False)
+            entry = (stamp, nc)
+            self.opens += 1
+        else:
+            self.hits += 1
+        self._datasets[path] = entry
+        return entry[1]
+
+    def metadata(self, path):
+        """Metadata of a forcing file, cached until the file changes.
+
+        Parameters
+        ----------
+        path : str
+            NetCDF file.
+
+        Returns
+        -------
+        dict
+            ``time_units``, ``time_calendar``, ``n_times``, ``time_axis``
+            (a ``TimeAxis``), ``catchment_ids`` (None without a ``catID``
+            variable), ``dimension_sizes`` and ``variables``, mapping every variable to its
+            ``long_name``, ``units``, ``dtype`` (as read, i.e. unpacked),
+            ``dimensions`` and CF ``scale_factor`` and ``add_offset``
+            (None when not packed).
+        """
+        path = os.path.abspath(path)
+        key = (path,) + self._stamp(path)
+        meta = self._metadata.get(key)
+        if meta is not None:
+            return meta
+
+        nc = self.open(path)
+        time_var = nc.variables['Time']
+        cat_id = None
+        if 'catID' in nc.variables:
+            cat_id = nc.variables['catID'][...]
+            cat_id = [str(cat_id)] if np.ndim(cat_id) == 0 else [str(c) for c in cat_id]
+        variables = {}
+        for name, var in nc.variables.items():
+            scale_factor = getattr(var, "scale_factor", None)
+            add_offset = getattr(var, "add_offset", None)
+            dtype = var.dtype
+            if scale_factor is not None or add_offset is not None:
+                # packed variables are read unpacked, in the attribute type
+                dtype = np.result_type(*[a for a in (scale_factor, add_offset) if a is not None])
+            variables[name] = {"long_name": getattr(var, "long_name", name),
+                               "units": getattr(var, "units", ""),
+                               "dtype": dtype,
+                               "dimensions": var.dimensions,
+                               "scale_factor": None if scale_factor is None else float(scale_factor),
+                               "add_offset": None if add_offset is None else float(add_offset)}
+        calendar = getattr(time_var, "calendar", "standard")
+        meta = {"time_units": time_var.units,
+                "time_calendar": calendar,
+                "n_times": len(time_var),
+                "time_axis": TimeAxis(time_var[:], time_var.units, calendar),
+                "catchment_ids": cat_id,
+                "dimension_sizes": {name: len(dim) for name, dim in nc.dimensions.items()},
+                "variables": variables}
+        # drop entries of older versions of the file
+        for old in [k for k in self._metadata if k[0] == path]:
+            del self._metadata[old]
+        self._metadata[key] = meta
+        return meta
+
+    def catchment_index(self, path):
+        """Row of every catchment id of a file, cached with its metadata.
+
+        Parameters
+        ----------
+        path : str
+            NetCDF file with a ``catID`` variable.
+
+        Returns
+        -------
+        dict
+            Catchment id to row along the catchment dimension.
+        """
+        meta = self.metadata(path)
+        index = meta.get("catchment_index")
+        if index is None:
+            index = {c: i for i, c in enumerate(meta["catchment_ids"] or [])}
+            meta["catchment_index"] = index
+        return index
+
+    def release(self, path):
+        """Close the pooled dataset of ``path``, if open.
+
+        Parameters
+        ----------
+        path : str
+            NetCDF file.
+        """
+        entry = self._datasets.pop(os.path.abspath(path), None)
+        if entry is not None:
+            entry[1].close()
+
+    def close_all(self):
+        """Close every pooled dataset."""
+        while self._datasets:
+            self._datasets.popitem()[1][1].close()
+
+
+pool = DatasetPool()
@@ -0,0 +1,134 @@
+"""Opt-in call counters and latencies of BmiForcing and Forcing methods.
+
+A ``Profiler`` wraps methods of an object by setting instance attributes
+that shadow them, so nothing changes for objects that are not profiled.
+For every wrapped method it counts calls, total time and bytes copied
+and keeps the latest latencies for percentiles; methods given a ``log``
+function also keep one record per call (e.g. one per chunk read).
+"""
+
+import functools
+import json
+import threading
+import time
+
+import numpy as np
+
+
+class Profiler(object):
+
+    """Per-method statistics of wrapped methods."""
+
+    def __init__(self, max_samples=65536):
+        """Create an empty profiler.
+
+        Parameters
+        ----------
+        max_samples : int, optional
+            Latencies kept per method for the percentiles.
+        """
+        self.max_samples = max_samples
+        self._lock = threading.Lock()
+        self._stats = {}
+        self._log = {}
+        self._wrapped = []
+
+    def record(self, name, seconds, nbytes=0, entry=None):
+        """Record one call of ``name``.
+
+        Parameters
+        ----------
+        name : str
+            Method name.
+        seconds : float
+            Duration of the call.
+        nbytes : int, optional
+            Bytes copied by the call.
+        entry : dict, optional
+            Details to add to the log of ``name``.
+        """
+        # the prefetch worker records its reads from another thread
+        with self._lock:
+            stat = self._stats.get(name)
+            if stat is None:
+                stat = self._stats[name] = {"count": 0, "seconds": 0.0, "bytes": 0,
+                                            "samples": np.empty(self.max_samples)}
+            stat["samples"][stat["count"] % self.max_samples] = seconds
+            stat["count"] += 1
+            stat["seconds"] += seconds
+            stat["bytes"] += nbytes
+            if entry is not None:
+                entry.update(seconds=seconds, bytes=nbytes)
+                self._log.setdefault(name, []).append(entry)
+
+    def wrap(self, obj, name, nbytes=None, log=None, label=None):
+        """Time every call of method ``name`` of ``obj``.
+
+        Parameters
+        ----------
+        obj : object
+            Instance to profile.
+        name : str
+            Method name.
+        nbytes : callable, optional
+            ``nbytes(result, *args)``, the bytes copied by a call.
+        log : callable, optional
+            ``log(*args)``, a dict of details to log for every call.
+        label : str, optional
+            Name of the statistics, ``name`` without leading underscores
+            by default.
+        """
+        method = getattr(obj, name)
+        label = label or name.lstrip("_")
+        record = self.record
+        clock = time.perf_counter
+
+        @functools.wraps(method)
+        def wrapper(*args, **kwargs):
+            tic = clock()
+            result = method(*args, **kwargs)
+            seconds = clock() - tic
+            record(label, seconds, 0 if nbytes is None else int(nbytes(result, *args)),
+                   None if log is None else log(*args))
+            return result
+
+        setattr(obj, name, wrapper)
+        self._wrapped.append((obj, name))
+
+    def unwrap(self):
+        """Remove every wrapper, restoring the plain methods."""
+        for obj, name in self._wrapped:
+            obj.__dict__.pop(name, None)
+        self._wrapped = []
+
+    def summary(self):
+        """Statistics of every method.
+
+        Returns
+        -------
+        dict
+            ``methods``: count, total and mean seconds, p50/p90/p99/max
+            latencies and bytes per method; ``log``: the logged calls.
+        """
+        methods = {}
+        with self._lock:
+            for name, stat in sorted(self._stats.items()):
+                samples = stat["samples"][:min(stat["count"], self.max_samples)]
+                p50, p90, p99 = np.percentile(samples, [50, 90, 99])
+                methods[name] = {"count": stat["count"],
+                                 "total_seconds": stat["seconds"],
+                                 "mean_seconds": stat["seconds"] / stat["count"],
+                                 "p50_seconds": float(p50),
+                                 "p90_seconds": float(p90),
+                                 "p99_seconds": float(p99),
+                                 "max_seconds": float(samples.max()),
+                                 "bytes": stat["bytes"]}
+            log = {name: list(entries) for name, entries in self._log.items()}
+        return {"methods": methods, "log": log}
+
+    def dump(self, filename, **extra):
+        """Write ``summary`` and ``extra`` entries to a JSON file."""
+        summary = self.summary()
+        summary.update(extra)
+        with open(filename, "w") as f:
+            json.dump(summary, f, indent=1)
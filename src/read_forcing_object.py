@@ -2,9 +2,31 @@
 Author: lcunha
 Date: 08/19/2021"""
 
+import glob
+import os
+import time
 import yaml
-from datetime import datetime
-import pandas as pd
+import numpy as np
+from areal_weights import ArealWeights
+from netcdf_pool import netcdf_lock as _netcdf_lock, pool as _pool
+from time_axis import TimeAxis
+
+# physical range of every variable, mapped onto the int16 codes when the
+# store is packed and the file gives no scale_factor/add_offset
+PACKED_RANGE = {
+    'LWDOWN': (0., 1000.),
+    'PSFC': (30000., 110000.),
+    'Q2D': (0., 0.06),
+    'RAINRATE': (0., 0.1),
+    'SWDOWN': (0., 1500.),
+    'T2D': (180., 340.),
+    'U2D': (-100., 100.),
+    'V2D': (-100., 100.),
+}
+
+# shared memory segments closed while views of them were still in use
+_mapped_segments = []
+
 class Forcing(object):
 
     def __init__(
@@ -13,18 +35,166 @@ class Forcing(object):
         start_time_date="2007-01-01 05:00:00", 
         end_time_date="2007-01-10 05:00:00",
         Netcdf_File=None,
-        Debug=1
+        Debug=1,
+        Catchment_IDs=None,
+        Catchment_Files=None,
+        Chunk_Size=None,
+        Prefetch=0,
+        Cache_File=None,
+        Shared_Memory=None,
+        Time_Step=3600,
+        Interpolation=None,
+        Shard_Index_File=None,
+        Max_Open_Files=None,
+        Tail_Interval=None,
+        Storage_Precision=None,
+        Packing=None,
+        Forcing_Server=None,
+        Profile=None,
+        Weight_File=None,
+        Catchment_Polygons=None,
+        Ensemble_Members=None,
+        Perturbations=None,
+        Ensemble_Seed=None,
+        Record_File=None,
+        Record_Buffer=None
     ):    
-        """Create a new Forcing model."""
+        """Create a new Forcing model.
+
+        A single ``Netcdf_File`` serves one catchment, or every catchment
+        of the file when it has a catchment dimension. Several
+        per-catchment files are served together from ``Catchment_Files``
+        (a list, a glob pattern or a directory of ``*.nc`` files), or from
+        ``Catchment_IDs`` when ``Netcdf_File`` is a template containing
+        ``{cat_id}``. Otherwise ``Catchment_IDs`` selects catchments of a
+        file with a catchment dimension, reading only their rows.
+        A gridded ``Netcdf_File`` (variables over Time, y and x) is averaged
+        over catchments with the sparse coverage weights of
+        ``Weight_File``, which are computed from the GeoJSON
+        ``Catchment_Polygons`` and cached in that file (or a temporary one)
+        when it does not exist yet.
+        ``Netcdf_File`` may also be a list or glob pattern of
+        time shards (e.g. monthly files) read as one timeline; their time
+        index is cached in ``Shard_Index_File``. Files are opened through
+        the process-wide ``netcdf_pool``, which keeps at most
+        ``Max_Open_Files`` of them open.
+
+        With ``Tail_Interval`` set (in seconds), time steps appended to the
+        forcing files, or new shards matching ``Netcdf_File``, are picked
+        up by ``poll`` and served without re-initializing.
+
+        With ``Chunk_Size`` set, only that many time steps are kept in
+        memory and the next chunk is read when a step outside of it is
+        requested through ``load_step``. ``Prefetch`` reads the following
+        chunk on a worker thread into a second buffer that is swapped in
+        when the model reaches it.
+
+        ``Cache_File`` names a binary cache written by ``forcing_cache``;
+        it is memory-mapped instead of reading the NetCDF files.
+        ``Shared_Memory`` names a shared memory segment holding the same
+        layout, which is attached instead. With ``Forcing_Server`` set, the
+        segment published by ``forcing_server`` for the forcing source of
+        this configuration is attached.
+
+        ``Time_Step`` is the model time step in seconds, a divisor of the
+        forcing step (the spacing of the ``Time`` axis, whose units may be
+        seconds, minutes, hours or days since an origin, in any CF
+        calendar). Values between forcing steps are interpolated
+        per variable as given by ``Interpolation`` (``linear`` or
+        ``constant``), by default linearly for state variables and
+        constant for precipitation and radiation.
+
+        ``Storage_Precision`` sets the dtype of the in-memory store:
+        ``float64``, ``float32`` or ``int16``, the latter packing every
+        variable CF-style with its own ``scale_factor`` and ``add_offset``
+        (from ``Packing``, the file attributes or ``PACKED_RANGE``, in
+        that order). Packed steps are decoded to float32 when served.
+
+        ``Profile`` (true, or a JSON file written at ``finalize``) times
+        the BMI and read methods, see ``profiling``.
+
+        Ensemble members come from a ``member`` dimension of a single
+        ``Netcdf_File``, read as ``n_members`` times as many catchments
+        (member-major, ids suffixed ``_m<member>``), or are generated by
+        ``BmiForcing`` from ``Ensemble_Members``, ``Perturbations`` and
+        ``Ensemble_Seed``, see ``ensemble``.
+
+        ``Record_File`` names a NetCDF file to which ``BmiForcing`` writes
+        the values it served, ``Record_Buffer`` steps at a time on a
+        background thread, see ``recorder``.
+        """
         
         self._STAND_ALONE = STAND_ALONE
         self._start_time_date = start_time_date
         self._end_time_date = end_time_date
         self._Netcdf_File = Netcdf_File     
         self._Debug = Debug          
-        self._time_series_df = pd.DataFrame()
+        self._Catchment_IDs = Catchment_IDs
+        self._Catchment_Files = Catchment_Files
+        self._Chunk_Size = Chunk_Size
+        self._Prefetch = Prefetch
+        self._Cache_File = Cache_File
+        self._Shared_Memory = Shared_Memory
+        self._shm = None
+        self._Time_Step = Time_Step
+        self._Interpolation = Interpolation
+        self._Shard_Index_File = Shard_Index_File
+        self._Max_Open_Files = Max_Open_Files
+        if Max_Open_Files is not None:
+            _pool.max_open = Max_Open_Files
+        self._Tail_Interval = Tail_Interval
+        self._Storage_Precision = Storage_Precision
+        self._Packing = Packing
+        self._Forcing_Server = Forcing_Server
+        self._Profile = Profile
+        self._Weight_File = Weight_File
+        self._Catchment_Polygons = Catchment_Polygons
+        self._weights = None
+        self._Ensemble_Members = Ensemble_Members
+        self._Perturbations = Perturbations
+        self._Ensemble_Seed = Ensemble_Seed
+        self._Record_File = Record_File
+        self._Record_Buffer = Record_Buffer
+        # members of the member dimension of the forcing file, if any
+        self._n_members = 1
+        # same order as the BMI output names, so that blocks of all
+        # variables are plain slices of the store
+        self._vname = ['LWDOWN', 'PSFC', 'Q2D', 'RAINRATE', 'SWDOWN', 'T2D', 'U2D', 'V2D']
+        # catchment rows this close together are read as one run
+        self._max_gap = 32
+        self._values = None
+        self._values_beg = 0
+        self._values_rows = 0
+        self._n_times = 0
+        # dtype of the files, of the store, of the values served from it,
+        # and the per-variable scale and offset of a packed store (None
+        # otherwise)
+        self._file_dtype = None
+        self._dtype = None
+        self._value_dtype = None
+        # time axis of the first forcing file, the row of window step 0 in
+        # it, and the forcing step in seconds
+        self._time_axis = None
+        self._time_row = 0
+        self._forcing_step = 3600
+        self._scale = None
+        self._offset = None
+        self._files = []
+        self._var_index = {}
+        self._catchment_ids = []
         self._long_name = []
         self._units = []
+        self._load_nbytes = 0
+        self._load_seconds = 0.0
+        self._load_count = 0
+        self._next_values = None
+        self._prefetch = None
+        # (step, values) of the step after the resident chunk, see lookahead
+        self._lookahead = None
+        self._executor = None
+        self._prefetch_hits = 0
+        self._prefetch_misses = 0
+        self._prefetch_wait_seconds = 0.0
         self._time = 0.0
         self._time_step = 1.0
     def time(self):
@@ -32,12 +202,14 @@ class Forcing(object):
         return self._time
         
     @classmethod
-    def read_config(cls, file_like):
+    def read_config(cls, file_like, **overrides):
         """Create a Forcing object from a file-like object.
         Parameters
         ----------
         file_like : file_like
             Input parameter file.
+        **overrides
+            Parameters replacing those of the file.
         Returns
         -------
         Forcing
@@ -46,39 +218,909 @@ class Forcing(object):
 
         with open(file_like) as f:
             config = yaml.safe_load(f)        
+        config.update(overrides)
         return cls(**config)    
     
+    def _forcing_files(self):
+        """List the forcing sources, one per catchment column block.
+
+        Returns
+        -------
+        list of list of str
+            The time shards of every source; a single file is a source
+            with one shard.
+        """
+        files = self._Catchment_Files
+        if files is not None:
+            if isinstance(files, str):
+                if os.path.isdir(files):
+                    files = os.path.join(files, "*.nc")
+                files = sorted(glob.glob(files))
+            if len(files) == 0:
+                raise ValueError("no forcing files match " + str(self._Catchment_Files))
+            return [[path] for path in files]
+        if self._Catchment_IDs is not None and "{cat_id}" in str(self._Netcdf_File):
+            return [[self._Netcdf_File.format(cat_id=c)] for c in self._Catchment_IDs]
+        shards = self._Netcdf_File
+        if isinstance(shards, str):
+            if not any(c in shards for c in "*?["):
+                return [[shards]]
+            shards = sorted(glob.glob(shards))
+        if len(shards) == 0:
+            raise ValueError("no forcing files match " + str(self._Netcdf_File))
+        return [list(shards)]
+
+    def _time_window(self, axis):
+        """Row range of the start/end window in a time axis.
+
+        Parameters
+        ----------
+        axis : TimeAxis
+            Time axis of a forcing file.
+
+        Returns
+        -------
+        tuple of int
+            First row, which is negative when the file starts after
+            ``start_time_date``, and end row, at most the length of the
+            axis.
+        """
+        index_beg = axis.index(self._start_time_date)
+        if(self._end_time_date==-9):
+            index_end=index_beg+1
+        else:
+            index_end = axis.index(self._end_time_date)
+        return index_beg, min(index_end, len(axis))
+
+    def _shard_index(self, shards):
+        """Time axis of every shard, sorted by time.
+
+        The index is cached in ``Shard_Index_File`` (by default a file in
+        the temporary directory named after ``Netcdf_File``) and rebuilt
+        only when shards are added, removed or modified.
+
+        Returns
+        -------
+        list of tuple
+            ``(path, axis)`` of every shard. Regular axes are rebuilt from
+            the index, irregular ones are read from the shard.
+        """
+        import hashlib
+        import json
+        import tempfile
+
+        shards = [os.path.abspath(path) for path in shards]
+        index_file = self._Shard_Index_File
+        if index_file is None:
+            # named after the pattern, so shards appended later reuse it
+            pattern = self._Netcdf_File
+            if isinstance(pattern, str):
+                pattern = os.path.abspath(pattern)
+            else:
+                pattern = "\n".join(sorted(shards))
+            key = hashlib.sha1(pattern.encode()).hexdigest()
+            index_file = os.path.join(tempfile.gettempdir(), "forcing_shards_" + key + ".json")
+        stamps = {path: [os.stat(path).st_mtime_ns, os.stat(path).st_size] for path in shards}
+        index = None
+        try:
+            with open(index_file) as f:
+                cached = json.load(f)
+            if cached.get("version") == 2 and cached["stamps"] == stamps:
+                index = cached["shards"]
+        except (OSError, ValueError, KeyError):
+            pass
+
+        if index is None:
+            index = []
+            for path in shards:
+                axis = _pool.metadata(path)["time_axis"]
+                index.append({"path": path,
+                              "start": axis.date(0).isoformat(sep=" "),
+                              "n_times": len(axis),
+                              "time_units": axis.units,
+                              "calendar": axis.calendar,
+                              "first": axis.first,
+                              "step": axis.step if axis.regular else None})
+            index.sort(key=lambda shard: shard["start"])
+            try:
+                with open(index_file, "w") as f:
+                    json.dump({"version": 2, "stamps": stamps, "shards": index}, f)
+            except OSError:
+                pass
+
+        axes = []
+        for shard in index:
+            if shard["step"] is None:
+                axis = _pool.metadata(shard["path"])["time_axis"]
+            else:
+                axis = TimeAxis.regular_axis(shard["n_times"], shard["time_units"], shard["step"],
+                                             shard["calendar"], shard["first"])
+            axes.append((shard["path"], axis))
+        return axes
+
+    def _time_segments(self, shards):
+        """Map the window onto the files of one source.
+
+        Returns
+        -------
+        tuple of (list, TimeAxis)
+            ``(path, row, seg_beg, seg_end)`` segments, window steps
+            [seg_beg, seg_end) being rows ``row`` onwards of ``path``, and
+            the time axis of the first file.
+        """
+        if len(shards) == 1:
+            axis = _pool.metadata(shards[0])["time_axis"]
+            index_beg, index_end = self._time_window(axis)
+            if index_beg < 0:
+                raise ValueError("the forcing of " + shards[0] + " starts after " + str(self._start_time_date))
+            if index_end <= index_beg:
+                raise ValueError("the forcing of " + shards[0] + " ends before " + str(self._start_time_date))
+            return [(shards[0], index_beg, 0, index_end-index_beg)], axis
+
+        # only the shards overlapping the window are kept; they must follow
+        # each other without gaps
+        segments = []
+        covered = 0
+        first_axis = None
+        for path, axis in self._shard_index(shards):
+            index_beg, index_end = self._time_window(axis)
+            if index_end <= max(index_beg, 0):
+                continue
+            if not segments and index_beg < 0:
+                raise ValueError("the forcing of " + path + " starts after " + str(self._start_time_date))
+            row = max(index_beg, 0)
+            if row - index_beg != covered:
+                raise ValueError(path + " does not continue the previous forcing shard")
+            segments.append((path, row, covered, index_end - index_beg))
+            covered = index_end - index_beg
+            if first_axis is None:
+                first_axis = axis
+        if len(segments) == 0:
+            raise ValueError("no forcing shard overlaps the time window")
+        return segments, first_axis
+
+    def _catchment_selection(self, path):
+        """Plan the reads of the ``Catchment_IDs`` rows of a file.
+
+        Sorted rows are merged into contiguous runs, bridging gaps of up
+        to ``_max_gap`` rows, so scattered ids become a few hyperslab
+        reads.
+
+        Returns
+        -------
+        tuple of (list, ndarray)
+            ``(start, stop)`` runs along the catchment dimension, and the
+            position of every requested catchment in the concatenated
+            runs.
+        """
+        index = _pool.catchment_index(path)
+        missing = [c for c in self._Catchment_IDs if str(c) not in index]
+        if missing:
+            raise ValueError(path + " has no catchment " + ", ".join(str(c) for c in missing[:5]))
+        rows = np.array([index[str(c)] for c in self._Catchment_IDs], dtype=np.intp)
+        unique = np.unique(rows)
+        breaks = np.flatnonzero(np.diff(unique) > self._max_gap + 1) + 1
+        starts = unique[np.r_[0, breaks]]
+        stops = unique[np.r_[breaks - 1, len(unique) - 1]] + 1
+        runs = list(zip(starts.tolist(), stops.tolist()))
+        # offset of every run in the concatenation
+        offsets = np.cumsum([0] + [stop - start for start, stop in runs])[:-1]
+        run = np.searchsorted(starts, rows, side="right") - 1
+        return runs, offsets[run] + rows - starts[run]
+
+    def _file_catchment_ids(self, path, meta):
+        """Catchment ids of a file without a ``catID`` variable.
+
+        That is the file name, suffixed with the row when the file has a
+        catchment dimension of more than one row.
+        """
+        name = os.path.splitext(os.path.basename(path))[0]
+        dims = [d for d in meta["variables"][self._vname[0]]["dimensions"] if d not in ('Time', 'member')]
+        if len(dims) != 1 or meta["dimension_sizes"][dims[0]] == 1:
+            return [name]
+        return [name + "_" + str(i) for i in range(meta["dimension_sizes"][dims[0]])]
+
+    def _scan_files(self):
+        """Find the time window and catchments of every forcing source.
+
+        Fills ``_files`` with ``(column, n_cats, segments, selection)``
+        entries, see ``_time_segments`` and ``_catchment_selection``
+        (None when every catchment of the file is read; the
+        ``ArealWeights`` of a gridded file), and sets the
+        window length, catchment ids and variable attributes.
+        """
+        with _netcdf_lock:
+            self._scan_files_locked()
+            self._release_tailed_files()
+
+    def _scan_files_locked(self):
+        sources = self._forcing_files()
+        self._files = []
+        self._catchment_ids = []
+        self._long_name = []
+        self._units = []
+        self._n_times = None
+        for shards in sources:
+            segments, axis = self._time_segments(shards)
+            path = segments[0][0]
+            meta = _pool.metadata(path)
+            n_times = segments[-1][3]
+            cat_id = meta["catchment_ids"]
+            if cat_id is None:
+                cat_id = self._file_catchment_ids(path, meta)
+            selection = None
+            if self._Weight_File is not None or self._Catchment_Polygons is not None:
+                if self._weights is None:
+                    self._weights = self._areal_weights(path)
+                selection = self._weights
+                cat_id = self._weights.catchment_ids
+            elif self._Catchment_IDs is not None and len(sources) == 1 and "{cat_id}" not in str(self._Netcdf_File):
+                selection = self._catchment_selection(path)
+                cat_id = [str(c) for c in self._Catchment_IDs]
+            if "member" in meta["variables"][self._vname[0]]["dimensions"]:
+                if len(sources) > 1 or selection is not None:
+                    raise ValueError(path + " has a member dimension, which is only read from a"
+                                     + " single Netcdf_File with all its catchments")
+                self._n_members = meta["dimension_sizes"]["member"]
+                cat_id = [str(c) + "_m" + str(m) for m in range(self._n_members) for c in cat_id]
+            if self._n_times is None:
+                self._n_times = n_times
+                self._set_time_axis(axis, segments[0][1])
+                variables = meta["variables"]
+                self._set_storage(variables)
+                for v in self._vname:
+                    self._long_name.append(variables[v]["long_name"])
+                    self._units.append(variables[v]["units"])
+            elif n_times != self._n_times:
+                raise ValueError(path + " does not cover the same time window as " + sources[0][0])
+            self._files.append((len(self._catchment_ids), len(cat_id), segments, selection))
+            self._catchment_ids.extend(str(c) for c in cat_id)
+
+    def _areal_weights(self, path):
+        """Coverage weights of the catchments over the grid of ``path``.
+
+        Loaded from ``Weight_File``, or computed from
+        ``Catchment_Polygons`` and saved to ``Weight_File`` (by default a
+        file in the temporary directory named after the polygons and the
+        grid) so that later runs only load them.
+
+        Returns
+        -------
+        ArealWeights
+            Weights of the ``Catchment_IDs``, or of every polygon.
+        """
+        weight_file = self._Weight_File
+        nc = _pool.open(path)
+        grid_shape = nc.variables[self._vname[0]].shape[-2:]
+        if weight_file is None or not os.path.exists(weight_file):
+            if self._Catchment_Polygons is None:
+                raise FileNotFoundError("no weight file " + str(weight_file))
+            y_dim, x_dim = nc.variables[self._vname[0]].dimensions[-2:]
+            if x_dim not in nc.variables or y_dim not in nc.variables:
+                raise ValueError(path + " has no " + x_dim + "/" + y_dim + " coordinates to build weights")
+            x = nc.variables[x_dim][:]
+            y = nc.variables[y_dim][:]
+            if weight_file is None:
+                import hashlib
+                import tempfile
+
+                polygons = os.path.abspath(self._Catchment_Polygons)
+                stat = os.stat(polygons)
+                key = hashlib.sha1((polygons + str(stat.st_mtime_ns) + str(stat.st_size)).encode()
+                                   + np.asarray(x).tobytes() + np.asarray(y).tobytes()).hexdigest()
+                weight_file = os.path.join(tempfile.gettempdir(), "forcing_weights_" + key + ".npz")
+            if not os.path.exists(weight_file):
+                ArealWeights.from_polygons(self._Catchment_Polygons, x, y).save(weight_file)
+        weights = ArealWeights.load(weight_file)
+        if weights.grid_shape != tuple(grid_shape):
+            raise ValueError(str(weight_file) + " is for a " + str(weights.grid_shape)
+                             + " grid, not " + str(tuple(grid_shape)))
+        if self._Catchment_IDs is not None:
+            weights = weights.subset(self._Catchment_IDs)
+        return weights
+
+    def _set_time_axis(self, axis, row):
+        """Use ``axis``, whose row ``row`` is window step 0, for date arithmetic.
+
+        The forcing step is the spacing of the axis; the rows of an
+        irregular axis are served at their times (see ``step_at``), values
+        being interpolated between rows an hour apart.
+        """
+        self._time_axis = axis
+        self._time_row = row
+        self._forcing_step = int(round(axis.step_seconds or 3600))
+
+    def seconds_since_start(self, date):
+        """Seconds from ``start_time_date`` to ``date`` in the forcing calendar.
+
+        Parameters
+        ----------
+        date : str
+            ISO date.
+
+        Returns
+        -------
+        float
+            Seconds.
+        """
+        return self._time_axis.seconds_between(self._start_time_date, date)
+
+    def window_start(self):
+        """Date of window step 0, the forcing row at or before ``start_time_date``."""
+        return self._time_axis.date(self._time_row)
+
+    def start_offset(self):
+        """Seconds from ``window_start`` to ``start_time_date``."""
+        axis = self._time_axis
+        return (axis.value(self._start_time_date) - axis.row_value(self._time_row)) * axis.unit_seconds
+
+    def window_times(self):
+        """Seconds from ``window_start`` to every window step.
+
+        Returns
+        -------
+        ndarray
+            Seconds of the ``_n_times`` window steps.
+        """
+        axis = self._time_axis
+        origin = axis.row_value(self._time_row)
+        if axis.regular:
+            return np.arange(self._n_times) * float(self._forcing_step)
+        rows = range(self._time_row, self._time_row + self._n_times)
+        return (np.array([axis.row_value(r) for r in rows]) - origin) * axis.unit_seconds
+
+    def step_at(self, seconds):
+        """Window step served ``seconds`` after ``window_start``.
+
+        That is the last step at or before that time, found by bisection
+        on an irregular axis (extrapolated past the window).
+
+        Returns
+        -------
+        int
+            Window step.
+        """
+        axis = self._time_axis
+        if axis.regular:
+            return int(seconds // self._forcing_step)
+        origin = axis.row_value(self._time_row)
+        return axis.value_index(origin + seconds / axis.unit_seconds) - self._time_row
+
+    def step_seconds(self, t):
+        """Seconds from ``window_start`` to window step ``t``, see ``step_at``."""
+        axis = self._time_axis
+        if axis.regular:
+            return float(t * self._forcing_step)
+        origin = axis.row_value(self._time_row)
+        return (axis.row_value(self._time_row + t) - origin) * axis.unit_seconds
+
+    def _set_storage(self, variables):
+        """Choose the store dtype and packing from ``Storage_Precision``.
+
+        Parameters
+        ----------
+        variables : dict
+            Variable metadata of the first forcing file.
+        """
+        precision = self._Storage_Precision
+        self._file_dtype = np.result_type(*[variables[v]["dtype"] for v in self._vname])
+        if precision is None:
+            self._dtype = self._file_dtype
+        elif str(precision) in ('float32', 'float64', 'int16'):
+            self._dtype = np.dtype(str(precision))
+        else:
+            raise ValueError("unknown Storage_Precision " + str(precision))
+        self._value_dtype = self._dtype
+        self._scale = self._offset = None
+        if self._dtype != np.int16:
+            return
+
+        packing = self._Packing or {}
+        scale = []
+        offset = []
+        for v in self._vname:
+            if v in packing:
+                scale.append(packing[v]["scale_factor"])
+                offset.append(packing[v].get("add_offset", 0.))
+            elif variables[v].get("scale_factor") is not None:
+                scale.append(variables[v]["scale_factor"])
+                offset.append(variables[v].get("add_offset") or 0.)
+            else:
+                low, high = PACKED_RANGE[v]
+                scale.append((high - low) / 65534.)
+                offset.append((high + low) / 2.)
+        self._value_dtype = np.dtype(np.float32)
+        self._scale = np.array(scale, dtype=np.float32)
+        self._offset = np.array(offset, dtype=np.float32)
+
+    def _store(self, dest, i, data):
+        """Write values of variable ``i`` into the store, packing them if needed."""
+        if self._scale is None:
+            dest[...] = data
+            return
+        # values outside of the packed range are clipped to it
+        packed = np.subtract(data, self._offset[i], dtype=np.float32)
+        packed /= self._scale[i]
+        np.rint(packed, out=packed)
+        np.clip(packed, -32767, 32767, out=packed)
+        dest[...] = packed
+
+    def decode(self, raw, out=None):
+        """Values of store rows ``raw`` as served to models.
+
+        Parameters
+        ----------
+        raw : ndarray
+            (n_vars x ...) slice of the store.
+        out : ndarray, optional
+            Destination of the decoded values.
+
+        Returns
+        -------
+        ndarray
+            ``raw`` itself (or ``out`` filled from it) unless the store is
+            packed, in which case the float32 values ``raw * scale_factor
+            + add_offset``.
+        """
+        if self._scale is None:
+            if out is None:
+                return raw
+            out[...] = raw
+            return out
+        shape = (-1,) + (1,) * (raw.ndim - 1)
+        if out is None:
+            out = np.empty(raw.shape, dtype=self._value_dtype)
+        np.multiply(raw, self._scale.reshape(shape), out=out)
+        out += self._offset.reshape(shape)
+        return out
+
+    def _read_block(self, beg, end, out):
+        """Read window steps [beg, end) of all variables into ``out``.
+
+        Parameters
+        ----------
+        beg, end : int
+            Steps relative to ``start_time_date``.
+        out : ndarray
+            (n_vars x end-beg x n_catchments) destination.
+        """
+        with _netcdf_lock:
+            self._read_block_locked(beg, end, out)
+            self._release_tailed_files()
+
+    def _release_tailed_files(self):
+        """In tail mode, close the forcing files so writers can append."""
+        if self._Tail_Interval is None:
+            return
+        for col, n_cats, segments, selection in self._files:
+            for segment in segments:
+                _pool.release(segment[0])
+
+    def _read_block_locked(self, beg, end, out):
+        tic = time.perf_counter()
+        for col, n_cats, segments, selection in self._files:
+            for path, row, seg_beg, seg_end in segments:
+                if seg_end <= beg or seg_beg >= end:
+                    continue
+                lo, hi = max(beg, seg_beg), min(end, seg_end)
+                nc = _pool.open(path)
+                block = out[:, lo-beg:hi-beg, col:col+n_cats]
+                rows = slice(row+lo-seg_beg, row+hi-seg_beg)
+                if isinstance(selection, ArealWeights):
+                    self._read_gridded(nc, rows, selection, block)
+                    continue
+                if selection is not None:
+                    self._read_selection(nc, rows, selection, block)
+                    continue
+                for i, v in enumerate(self._vname):
+                    var = nc.variables[v]
+                    if 'member' in var.dimensions:
+                        self._store(block[i], i, self._read_members(var, rows))
+                    elif var.ndim == 1:
+                        self._store(block[i, :, 0], i, var[rows])
+                    elif var.dimensions[0] == 'Time':
+                        self._store(block[i], i, var[rows, :])
+                    else:
+                        self._store(block[i], i, var[:, rows].T)
+        self._load_nbytes += out.nbytes
+        self._load_seconds += time.perf_counter() - tic
+        self._load_count += 1
+
+    def _read_members(self, var, rows):
+        """(n_rows x n_members*n_cats) values of a variable with a member dimension."""
+        dims = var.dimensions
+        data = var[tuple(rows if d == 'Time' else slice(None) for d in dims)]
+        data = np.moveaxis(data, [dims.index('Time'), dims.index('member')], [0, 1])
+        return data.reshape(len(data), -1)
+
+    def _read_selection(self, nc, rows, selection, block):
+        """Read the selected catchments of ``rows`` run by run into ``block``."""
+        runs, take = selection
+        buf = np.empty((rows.stop-rows.start, sum(stop-start for start, stop in runs)),
+                       dtype=self._file_dtype)
+        for i, v in enumerate(self._vname):
+            var = nc.variables[v]
+            offset = 0
+            for start, stop in runs:
+                if var.dimensions[0] == 'Time':
+                    buf[:, offset:offset+stop-start] = var[rows, start:stop]
+                else:
+                    buf[:, offset:offset+stop-start] = var[start:stop, rows].T
+                offset += stop - start
+            if buf.dtype == block.dtype:
+                np.take(buf, take, axis=1, out=block[i])
+            else:
+                self._store(block[i], i, buf.take(take, axis=1))
+
+    def _read_gridded(self, nc, rows, weights, block):
+        """Average the grid window of ``rows`` over the catchments into ``block``."""
+        y0, y1, x0, x1 = weights.window
+        for i, v in enumerate(self._vname):
+            self._store(block[i], i, weights.aggregate(nc.variables[v][rows, y0:y1, x0:x1]))
+
     def read_forcing(self):
         
         """Reads netcdf for specific time window  """
-        import netCDF4 as netcdf
-
-        #print (self._Netcdf_File)
-        nc = netcdf.Dataset(self._Netcdf_File)
-        #varsInFile = nc.variables.keys()
-        time_units = nc.variables['Time'].units
-        #Cat_ID=nc['catID'][:]
-        vname=['RAINRATE', 'T2D', 'Q2D', 'U2D', 'V2D', 'PSFC', 'SWDOWN', 'LWDOWN']
-    
-        if("hours since " in time_units):
-            date_from=datetime.fromisoformat(time_units.replace("hours since ",""))
-            #print (date_from)
+        if self._Forcing_Server and self._Shared_Memory is None:
+            from forcing_server import SOURCE_KEYS, segment_name
+
+            self._Shared_Memory = segment_name({k: getattr(self, "_" + k) for k in SOURCE_KEYS})
+        if self._Cache_File is not None or self._Shared_Memory is not None:
+            self._map_cache()
+            return
+        self._scan_files()
+        self._var_index = {v: i for i, v in enumerate(self._vname)}
+
+        # one preallocated (n_vars x n_times x n_catchments) buffer for all
+        # variables, or for one chunk of time steps when streaming; netCDF4
+        # masking is switched off so the reads land in it without
+        # masked-array copies
+        n_rows = self._n_times
+        if self._Chunk_Size is not None:
+            n_rows = min(int(self._Chunk_Size), n_rows)
+        self._values = np.empty((len(self._vname), n_rows, len(self._catchment_ids)),
+                                dtype=self._dtype)
+        self._load_nbytes = 0
+        self._load_seconds = 0.0
+        self._load_count = 0
+        self._load_chunk(0)
+
+    async def read_forcing_async(self, executor=None):
+        """``read_forcing`` run in ``executor``, awaitable from an event loop."""
+        import asyncio
+
+        await asyncio.get_running_loop().run_in_executor(executor, self.read_forcing)
+
+    def poll(self):
+        """Pick up time steps that arrived since the forcing was scanned.
+
+        When the whole window is resident, the new steps are read and
+        appended to the store, whose capacity doubles when full so that
+        appending is amortized O(1). In streaming mode they are read with
+        the chunks that contain them.
+
+        Returns
+        -------
+        int
+            Number of new time steps.
+        """
+        if self._Cache_File is not None or self._Shared_Memory is not None:
+            return 0
+        n_times, n_cats = self._n_times, len(self._catchment_ids)
+        self._scan_files()
+        if len(self._catchment_ids) != n_cats:
+            raise ValueError("the catchments of the forcing files changed")
+        if self._n_times <= n_times:
+            self._n_times = n_times
+            return 0
+        if self._Chunk_Size is None:
+            if self._n_times > self._values.shape[1]:
+                grown = np.empty((self._values.shape[0], max(self._n_times, 2*self._values.shape[1]), n_cats),
+                                 dtype=self._values.dtype)
+                grown[:, :n_times] = self._values[:, :n_times]
+                self._values = grown
+            self._read_block(n_times, self._n_times, self._values[:, n_times:self._n_times])
+            self._values_rows = self._n_times
+        return self._n_times - n_times
+
+    def _map_cache(self):
+        """Serve the time window straight from a cache file or segment."""
+        from forcing_cache import attach_shared_memory, open_buffer, open_cache
+
+        tic = time.perf_counter()
+        if self._Shared_Memory is not None:
+            try:
+                self._shm = attach_shared_memory(self._Shared_Memory)
+            except FileNotFoundError:
+                if not self._Forcing_Server:
+                    raise
+                raise FileNotFoundError("no forcing server publishes " + self._Shared_Memory
+                                        + "; start forcing_server.py with this configuration")
+            header, values = open_buffer(self._shm.buf)
         else:
-            #print ("Check units ")
-            exit(0)
-        index_beg=int((datetime.fromisoformat(self._start_time_date)-date_from).total_seconds()/3600)
-        #print (index_beg)
-        if(self._end_time_date==-9):
-            index_end=index_beg+1
+            header, values = open_cache(self._Cache_File)
+        calendar = header.get("time_calendar", "standard")
+        if "time_values" in header:
+            axis = TimeAxis(header["time_values"], header["time_units"], calendar)
+        else:
+            # caches of version 1 are hourly, in "hours since" units
+            axis = TimeAxis.regular_axis(values.shape[1], header["time_units"],
+                                         header.get("time_step", 1.), calendar)
+        index_beg, index_end = self._time_window(axis)
+        if index_beg < 0:
+            raise ValueError("the forcing of " + str(self._Shared_Memory or self._Cache_File)
+                             + " starts after " + str(self._start_time_date))
+        if index_end <= index_beg:
+            raise ValueError("the forcing of " + str(self._Shared_Memory or self._Cache_File)
+                             + " ends before " + str(self._start_time_date))
+        self._set_time_axis(axis, index_beg)
+        self._vname = header["variables"]
+        self._var_index = {v: i for i, v in enumerate(self._vname)}
+        self._catchment_ids = header["catchment_ids"]
+        self._n_members = header.get("n_members", 1)
+        self._long_name = header["long_name"]
+        self._units = header["units"]
+        self._dtype = self._value_dtype = values.dtype
+        self._scale = self._offset = None
+        if "scale_factor" in header:
+            self._value_dtype = np.dtype(np.float32)
+            self._scale = np.array(header["scale_factor"], dtype=np.float32)
+            self._offset = np.array(header["add_offset"], dtype=np.float32)
+        self._values = values[:, index_beg:index_end]
+        self._values_beg = 0
+        self._values_rows = self._n_times = self._values.shape[1]
+        self._load_seconds = time.perf_counter() - tic
+
+    def _load_chunk(self, beg):
+        """Read the chunk starting at window step ``beg`` into the store."""
+        n_rows = min(self._values.shape[1], self._n_times-beg)
+        self._read_block(beg, beg+n_rows, self._values[:, :n_rows])
+        self._values_beg = beg
+        self._values_rows = n_rows
+        self._prefetch_next()
+
+    def _prefetch_next(self):
+        """Start reading the chunk after the resident one on the worker thread."""
+        beg = self._values_beg + self._values.shape[1]
+        if not self._Prefetch or beg >= self._n_times:
+            return
+        from concurrent.futures import ThreadPoolExecutor
+
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=1)
+            self._next_values = np.empty_like(self._values)
+        n_rows = min(self._values.shape[1], self._n_times-beg)
+        future = self._executor.submit(self._read_block, beg, beg+n_rows,
+                                       self._next_values[:, :n_rows])
+        self._prefetch = (beg, n_rows, future)
+
+    def _swap_prefetched(self, beg):
+        """Swap in the prefetched chunk if it starts at ``beg``.
+
+        Waits for any pending read first, so the worker never writes into
+        a buffer that is being served.
+
+        Returns
+        -------
+        bool
+            True if the resident chunk now starts at ``beg``.
+        """
+        if self._prefetch is None:
+            return False
+        prefetch_beg, n_rows, future = self._prefetch
+        self._prefetch = None
+        if prefetch_beg != beg and future.cancel():
+            return False
+        tic = time.perf_counter()
+        ready = future.done()
+        future.result()
+        self._prefetch_wait_seconds += time.perf_counter() - tic
+        if prefetch_beg != beg:
+            return False
+        if ready:
+            self._prefetch_hits += 1
+        else:
+            self._prefetch_misses += 1
+        self._values, self._next_values = self._next_values, self._values
+        self._values_beg = beg
+        self._values_rows = n_rows
+        self._prefetch_next()
+        return True
+
+    def values_for_range(self, beg, end):
+        """Forcing of window steps [beg, end) for all variables.
+
+        Parameters
+        ----------
+        beg, end : int
+            Steps relative to ``start_time_date``.
+
+        Returns
+        -------
+        ndarray
+            (n_vars x end-beg x n_catchments) read-only view of the store
+            when the steps are resident and the store is not packed,
+            otherwise a newly read or decoded array. Views of a streamed
+            chunk are only valid until the next chunk is loaded.
+        """
+        if not 0 <= beg <= end <= self._n_times:
+            raise IndexError("time steps " + str(beg) + ":" + str(end) + " are outside the forcing window")
+        row = beg - self._values_beg
+        if 0 <= row and end - self._values_beg <= self._values_rows:
+            values = self._values[:, row:row+end-beg]
+            if self._scale is not None:
+                return self.decode(values)
+            values.flags.writeable = False
+            return values
+        values = np.empty((self._values.shape[0], end-beg, self._values.shape[2]),
+                          dtype=self._values.dtype)
+        self._read_block(beg, end, values)
+        return self.decode(values)
+
+    def lookahead(self, t):
+        """Decoded forcing of window step ``t``, just after the resident chunk.
+
+        Used to interpolate across the edge of a chunk. The step is taken
+        from the prefetched chunk once it has been read, otherwise read on
+        its own; either way once per chunk.
+
+        Parameters
+        ----------
+        t : int
+            Step relative to ``start_time_date``.
+
+        Returns
+        -------
+        ndarray
+            (n_vars x n_catchments) values, not to be modified.
+        """
+        if self._lookahead is not None and self._lookahead[0] == t:
+            return self._lookahead[1]
+        prefetch = self._prefetch
+        if (prefetch is not None and prefetch[0] == t and prefetch[2].done()
+                and prefetch[2].exception() is None):
+            values = self.decode(self._next_values[:, 0]).copy()
         else:
-            index_end=int((datetime.fromisoformat(self._end_time_date)-date_from).total_seconds()/3600)
-        #print (index_end)
-        for v in vname:
-            Temp_df=pd.DataFrame(nc.variables[v][index_beg:index_end].data,columns=[v])
-            self._time_series_df = pd.concat([self._time_series_df, Temp_df], axis=1)
-            self._long_name.append(nc.variables[v].long_name)
-            self._units.append(nc.variables[v].units)
- 
+            values = np.array(self.values_for_range(t, t+1)[:, 0])
+        self._lookahead = (t, values)
+        return values
+
+    def enable_profiling(self, profiler):
+        """Time the reads of this instance with ``profiler``.
+
+        Every block read (the initial load or a chunk, including prefetched
+        ones) is logged with its window steps, duration and bytes.
+
+        Parameters
+        ----------
+        profiler : profiling.Profiler
+            Profiler recording the calls.
+        """
+        profiler.wrap(self, "read_forcing")
+        profiler.wrap(self, "poll")
+        profiler.wrap(self, "load_step")
+        profiler.wrap(self, "_read_block", nbytes=lambda result, beg, end, out: out.nbytes,
+                      log=lambda beg, end, out: {"beg": beg, "end": end})
+
+    def prefetch_stats(self):
+        """Counters of the chunk prefetcher.
+
+        Returns
+        -------
+        dict
+            Chunks found ready (hits), chunks that had to be waited for or
+            read in the foreground (misses) and seconds spent blocked.
+        """
+        return {"hits": self._prefetch_hits,
+                "misses": self._prefetch_misses,
+                "wait_seconds": self._prefetch_wait_seconds}
+
+    def load_stats(self):
+        """Counters of the forcing reads.
+
+        Returns
+        -------
+        dict
+            Blocks read (the initial load and every chunk), bytes stored
+            and seconds spent reading, or mapping a cache.
+        """
+        return {"count": self._load_count,
+                "bytes": self._load_nbytes,
+                "seconds": self._load_seconds}
+
+    def close(self):
+        """Stop the prefetch worker and detach from shared memory.
+
+        Views of a shared memory segment still held by the caller (e.g.
+        from ``values_for_range``) stay valid: the segment then remains
+        mapped until the process exits.
+        """
+        if self._prefetch is not None:
+            self._prefetch[2].result()
+            self._prefetch = None
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+        if self._shm is not None:
+            self._values = None
+            try:
+                self._shm.close()
+            except BufferError:
+                _mapped_segments.append(self._shm)
+            self._shm = None
+
+    def load_step(self, t):
+        """Make window step ``t`` resident and return its row in the store.
+
+        Parameters
+        ----------
+        t : int
+            Step relative to ``start_time_date``.
+
+        Returns
+        -------
+        int
+            Row of ``t`` along the time axis of ``_values``.
+        """
+        row = t - self._values_beg
+        if 0 <= row < self._values_rows:
+            return row
+        if not 0 <= t < self._n_times:
+            raise IndexError("time step " + str(t) + " is outside the forcing window")
+        beg = t - t % self._values.shape[1]
+        if not self._swap_prefetched(beg):
+            tic = time.perf_counter()
+            self._load_chunk(beg)
+            if self._Prefetch:
+                self._prefetch_misses += 1
+                self._prefetch_wait_seconds += time.perf_counter() - tic
+        return t - self._values_beg
+
+    async def load_step_async(self, t, executor=None):
+        """``load_step`` that reads a missing chunk in ``executor``.
+
+        Parameters
+        ----------
+        t : int
+            Step relative to ``start_time_date``.
+        executor : concurrent.futures.Executor, optional
+            Executor running the read, the loop's default executor by
+            default.
+
+        Returns
+        -------
+        int
+            Row of ``t`` along the time axis of ``_values``.
+        """
+        import asyncio
+
+        row = t - self._values_beg
+        if 0 <= row < self._values_rows:
+            return row
+        return await asyncio.get_running_loop().run_in_executor(executor, self.load_step, t)
+
+    def to_dataframe(self):
+        """DataFrame view of the resident forcing, one column per variable.
+
+        Returns
+        -------
+        pandas.DataFrame
+            Frame sharing memory with the forcing store for a single
+            catchment (unless it is packed), or a copy with (variable,
+            catchment) columns.
+        """
+        import pandas as pd
+
+        vname = self._vname
+        values = self.decode(self._values[:, :self._values_rows])
+        index = range(self._values_beg, self._values_beg+self._values_rows)
+        if values.shape[2] == 1:
+            return pd.DataFrame(values[:, :, 0].T, index=index, columns=vname, copy=False)
+        # one (variable, catchment) column each; this one is a copy
+        columns = pd.MultiIndex.from_product([vname, self._catchment_ids])
+        return pd.DataFrame(values.transpose(1, 0, 2).reshape(values.shape[1], -1),
+                            index=index, columns=columns)
+
     # def advance_in_time(self):
     #     """Move cursor"""
     #
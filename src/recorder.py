@@ -0,0 +1,163 @@
+"""Record the forcing served by BmiForcing to a NetCDF file.
+
+Served steps are copied into preallocated buffers of ``buffer_steps``
+steps; a full buffer is handed to a background thread that appends it to
+the file while the next one fills, so recording costs one copy per step:
+
+    recorder = Recorder("served.nc", ["LWDOWN", ...], catchment_ids,
+                        "seconds since 2007-01-01 00:00:00")
+    recorder.record(time, step_values)
+    recorder.close()
+
+The file has the layout of a forcing file (``Time``, ``catID`` and one
+variable per forcing variable over ``Time`` and ``catchment-id``,
+zlib-compressed), so it can be read back as the ``Netcdf_File`` of a
+``Forcing`` to replay a run.
+"""
+
+import queue
+import threading
+
+import numpy as np
+from netcdf_pool import netcdf_lock as _netcdf_lock
+from netcdf_pool import pool as _pool
+
+
+class Recorder(object):
+
+    """Buffered writer of served forcing steps."""
+
+    def __init__(self, filename, variables, catchment_ids, time_units, calendar="standard",
+                 dtype=np.float32, buffer_steps=1024, n_buffers=2, units=None, long_names=None,
+                 attributes=None):
+        """Create the file and start the writer thread.
+
+        Parameters
+        ----------
+        filename : str
+            NetCDF file to write, replaced if it exists.
+        variables : list of str
+            Names of the recorded variables, in the order of the rows
+            passed to ``record``.
+        catchment_ids : list of str
+            Id of every node.
+        time_units : str
+            CF units of the recorded times, e.g. ``seconds since <date>``.
+        calendar : str, optional
+            CF calendar of the times.
+        dtype : dtype, optional
+            Type of the recorded values.
+        buffer_steps : int, optional
+            Steps per buffer, i.e. per write.
+        n_buffers : int, optional
+            Buffers in the ring; recording waits for the writer only when
+            all of them are full.
+        units, long_names : list of str, optional
+            Attributes of the variables.
+        attributes : dict, optional
+            Global attributes, e.g. the source of the forcing.
+        """
+        import netCDF4
+
+        n_nodes = len(catchment_ids)
+        self.buffer_steps = int(buffer_steps)
+        with _netcdf_lock:
+            # e.g. the file of an earlier run, opened to replay it
+            _pool.release(filename)
+            self._dataset = nc = netCDF4.Dataset(filename, "w")
+            nc.setncatts(attributes or {})
+            nc.createDimension("Time", None)
+            nc.createDimension("catchment-id", n_nodes)
+            time_var = nc.createVariable("Time", "f8", ("Time",))
+            time_var.units = time_units
+            time_var.calendar = calendar
+            cat_id = nc.createVariable("catID", str, ("catchment-id",))
+            cat_id[:] = np.array([str(c) for c in catchment_ids], dtype=object)
+            self._variables = []
+            for k, v in enumerate(variables):
+                var = nc.createVariable(v, dtype, ("Time", "catchment-id"), zlib=True, complevel=1,
+                                        chunksizes=(min(self.buffer_steps, max(1, 2**20 // n_nodes)), n_nodes))
+                if units is not None:
+                    var.units = units[k]
+                if long_names is not None:
+                    var.long_name = long_names[k]
+                self._variables.append(var)
+            self._time = time_var
+
+        self._buffers = [np.empty((len(variables), self.buffer_steps, n_nodes), dtype=dtype)
+                         for _ in range(n_buffers)]
+        self._times = [np.empty(self.buffer_steps) for _ in range(n_buffers)]
+        self._free = queue.Queue()
+        for i in range(1, n_buffers):
+            self._free.put(i)
+        self._full = queue.Queue()
+        self._current = 0
+        self._fill = 0
+        self._last_time = None
+        self._written = 0
+        self._error = None
+        self._thread = threading.Thread(target=self._write_loop, name="forcing-recorder", daemon=True)
+        self._thread.start()
+
+    def record(self, time, values):
+        """Record one step.
+
+        Steps at or before the last recorded time are ignored, so that a
+        step recorded twice appears once.
+
+        Parameters
+        ----------
+        time : float
+            Time of the step, in the units of the file.
+        values : ndarray
+            (n_vars x n_nodes) served values.
+        """
+        if self._last_time is not None and time <= self._last_time:
+            return
+        self._last_time = time
+        self._buffers[self._current][:, self._fill] = values
+        self._times[self._current][self._fill] = time
+        self._fill += 1
+        if self._fill == self.buffer_steps:
+            self._full.put((self._current, self._fill))
+            # waits only when the writer is a whole ring behind
+            self._current = self._free.get()
+            self._fill = 0
+            if self._error is not None:
+                raise self._error
+
+    def _write_loop(self):
+        """Append the full buffers to the file, in order, until closed."""
+        while True:
+            item = self._full.get()
+            if item is None:
+                return
+            buf, n = item
+            try:
+                if self._error is None:
+                    w = self._written
+                    with _netcdf_lock:
+                        self._time[w:w+n] = self._times[buf][:n]
+                        for var, values in zip(self._variables, self._buffers[buf]):
+                            var[w:w+n, :] = values[:n]
+                        self._dataset.sync()
+                    self._written += n
+            except BaseException as error:
+                self._error = error
+            finally:
+                self._free.put(buf)
+
+    def close(self):
+        """Write the steps left in the buffer and close the file."""
+        if self._thread is None:
+            return
+        if self._fill:
+            self._full.put((self._current, self._fill))
+            self._fill = 0
+        self._full.put(None)
+        self._thread.join()
+        self._thread = None
+        with _netcdf_lock:
+            self._dataset.close()
+        if self._error is not None:
+            raise self._error
@@ -19,6 +19,8 @@ if(getattr(bmi._model,'_Debug')==1):
     print (" component name: " + bmi.get_component_name())
     #print (" input item count: " + str(bmi.get_input_item_count()))
     print (" output item count: " + str(bmi.get_output_item_count()))
+    load = bmi._model.load_stats()
+    print (" forcing load: " + str(load["bytes"]) + " bytes in " + str(round(load["seconds"], 4)) + " s")
     #print (" input var names: " + bmi.get_input_var_names())
     print (" output var names: ")
     for n in bmi.get_output_var_names():
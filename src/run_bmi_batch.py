@@ -0,0 +1,135 @@
+"""Run many BMI Forcing configurations on a process pool.
+
+Configurations that read the same forcing source are loaded once, for the
+union of their time windows, into a shared memory segment that every
+worker attaches to instead of reading (or being sent) its own copy.
+
+    python run_bmi_batch.py cfg1.yaml cfg2.yaml ... --workers 8
+    python run_bmi_batch.py @configs.txt --json timings.json
+
+A file given as ``@configs.txt`` lists one configuration per line.
+"""
+
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import yaml
+from bmi_forcing import BmiForcing
+from forcing_server import share_sources, source_key
+
+
+def run_job(cfg_file, shm_name=None):
+    """Run one configuration from start to end of its window.
+
+    Every step is an ``update`` followed by ``get_value`` of every output
+    variable, as a coupled model would do.
+
+    Parameters
+    ----------
+    cfg_file : str
+        Configuration file.
+    shm_name : str, optional
+        Shared memory segment holding the forcing of the configuration.
+
+    Returns
+    -------
+    dict
+        Timings of the job.
+    """
+    tic = time.perf_counter()
+    bmi = BmiForcing()
+    if shm_name is None:
+        bmi.initialize(cfg_file)
+    else:
+        bmi.initialize(cfg_file, Shared_Memory=shm_name, Debug=0)
+    init_seconds = time.perf_counter() - tic
+
+    # forcing variables only; derived ones are computed on first request
+    names = bmi._forcing_var_names
+    dest = np.empty(bmi.get_grid_size(0), dtype=float)
+    n_steps = bmi._last_time_index()
+    tic = time.perf_counter()
+    for _ in range(n_steps):
+        bmi.update()
+        for name in names:
+            bmi.get_value(name, dest)
+    run_seconds = time.perf_counter() - tic
+    bmi.finalize()
+
+    return {"config": cfg_file,
+            "init_seconds": init_seconds,
+            "run_seconds": run_seconds,
+            "steps": n_steps,
+            "steps_per_second": n_steps / run_seconds if run_seconds > 0 else None}
+
+
+def run_batch(cfg_files, workers=None):
+    """Run configurations on a pool of at most ``workers`` processes.
+
+    Parameters
+    ----------
+    cfg_files : list of str
+        Configuration files.
+    workers : int, optional
+        Number of worker processes, ``os.cpu_count()`` by default.
+
+    Returns
+    -------
+    dict
+        Per-job timings and the aggregate throughput.
+    """
+    configs = []
+    for cfg_file in cfg_files:
+        with open(cfg_file) as f:
+            configs.append(yaml.safe_load(f))
+
+    tic = time.perf_counter()
+    segments = share_sources(configs)
+    share_seconds = time.perf_counter() - tic
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = []
+            for cfg_file, config in zip(cfg_files, configs):
+                shm = segments.get(source_key(config))
+                futures.append(pool.submit(run_job, cfg_file, None if shm is None else shm.name))
+            jobs = [f.result() for f in futures]
+    finally:
+        for shm in segments.values():
+            shm.close()
+            shm.unlink()
+    wall_seconds = time.perf_counter() - tic
+
+    steps = sum(job["steps"] for job in jobs)
+    return {"jobs": jobs,
+            "workers": workers or os.cpu_count(),
+            "shared_sources": len(segments),
+            "share_seconds": share_seconds,
+            "wall_seconds": wall_seconds,
+            "steps": steps,
+            "steps_per_second": steps / wall_seconds}
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0],
+                                     fromfile_prefix_chars="@")
+    parser.add_argument("configs", nargs="+", help="configuration files")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="worker processes, one per core by default")
+    parser.add_argument("--json", default=None, help="write the timings to this file")
+    args = parser.parse_args()
+
+    result = run_batch(args.configs, args.workers)
+    for job in result["jobs"]:
+        print(" " + job["config"] + ": " + str(job["steps"]) + " steps, init "
+              + str(round(job["init_seconds"], 4)) + " s, run "
+              + str(round(job["run_seconds"], 4)) + " s")
+    print(" " + str(len(result["jobs"])) + " jobs on " + str(result["workers"])
+          + " workers: " + str(round(result["steps_per_second"])) + " steps/s")
+    if args.json is not None:
+        with open(args.json, "w") as f:
+            json.dump(result, f, indent=1)
@@ -0,0 +1,485 @@
+"""Check the forcing features against synthetic forcing files.
+
+Every ``check_*`` function exercises one feature and compares what is
+served with the values written to the file, or with the plain run of the
+same forcing. The files are written with
+``benchmark_bmi.make_forcing_file`` (or by the check) to a temporary
+directory.
+
+    python run_bmi_feature_test.py
+"""
+
+import os
+import sys
+import tempfile
+import traceback
+
+import numpy as np
+import yaml
+from benchmark_bmi import make_forcing_file
+from bmi_forcing import BmiForcing
+from netcdf_pool import netcdf_lock, pool
+
+N_CATCHMENTS = 20
+N_TIMES = 24 * 20
+# first row of the window of ``config`` in the forcing file
+WINDOW_ROW = 24
+T2D = 'land_surface_air__temperature'
+
+pass_count = 0
+fail_count = 0
+fail_list = []
+
+
+def start(config, **options):
+    """Initialized BmiForcing of ``config`` updated with ``options``."""
+    config = dict(config, **options)
+    cfg_file = os.path.join(data_dir, "config.yaml")
+    with open(cfg_file, "w") as f:
+        yaml.safe_dump(config, f)
+    bmi = BmiForcing()
+    bmi.initialize(cfg_file)
+    return bmi
+
+
+def served(bmi, names=BmiForcing._forcing_var_names):
+    """Values of the forcing variables at the current time."""
+    n = bmi.get_grid_size(0)
+    return np.array([bmi.get_value(name, np.empty(n, dtype=bmi._step_values.dtype)) for name in names])
+
+
+def jump(bmi, index):
+    """Move ``bmi`` to time index ``index`` with ``update_until``."""
+    current = bmi.get_current_time()
+    bmi.update_until(current + (index - current) * bmi.get_time_step())
+    assert bmi.get_current_time() == index
+
+
+def run(bmi, n_steps):
+    """Values served at the next ``n_steps`` time steps."""
+    values = [served(bmi)]
+    for _ in range(n_steps - 1):
+        bmi.update()
+        values.append(served(bmi))
+    return np.array(values)
+
+
+def check_prefetch():
+    """Chunks swapped in by the prefetch thread serve the whole window."""
+    expected = run(start(config, Time_Step=900), 4 * 100)
+    bmi = start(config, Time_Step=900, Chunk_Size=24, Prefetch=1)
+    assert np.array_equal(run(bmi, 4 * 100), expected)
+    assert bmi._model.prefetch_stats()["hits"] > 0
+    # once the prefetch is read, the step after a chunk is taken from it
+    prefetched = start(config, Time_Step=900, Chunk_Size=24, Prefetch=1)
+    values = [served(prefetched)]
+    for _ in range(4 * 100 - 1):
+        if prefetched._model._prefetch is not None:
+            prefetched._model._prefetch[2].result()
+        prefetched.update()
+        values.append(served(prefetched))
+    assert np.array_equal(np.array(values), expected)
+    prefetched.finalize()
+    # a jump past the prefetched chunk cancels it
+    jump(bmi, 4 * 300 + 1)
+    reference = start(config, Time_Step=900)
+    jump(reference, 4 * 300 + 1)
+    assert np.array_equal(served(bmi), served(reference))
+    bmi.finalize()
+
+
+def check_cache():
+    """A cache file serves the forcing it was built from."""
+    from forcing_cache import build_cache
+
+    cache_file = os.path.join(data_dir, "forcing.frc")
+    build_cache(cache_file, forcing_file)
+    expected = run(start(config, Time_Step=1800), 2 * 200)
+    bmi = start(config, Time_Step=1800, Cache_File=cache_file)
+    assert np.array_equal(run(bmi, 2 * 200), expected)
+    bmi.finalize()
+    # a packed cache decodes like a packed store
+    build_cache(cache_file, forcing_file, storage_precision="int16")
+    assert np.array_equal(run(start(config, Cache_File=cache_file), 50),
+                          run(start(config, Storage_Precision="int16"), 50))
+
+
+def file_values(name):
+    """(n_times x n_catchments) values of variable ``name`` in the forcing file."""
+    with netcdf_lock:
+        return np.asarray(pool.open(forcing_file).variables[name][:]).T
+
+
+def check_interpolation():
+    """Sub-hourly steps interpolate states and hold mean rates."""
+    bmi = start(config, Time_Step=900)
+    got = run(bmi, 4 * 48)
+    row = WINDOW_ROW + np.arange(4 * 48) // 4
+    weight = (np.arange(4 * 48) % 4 / 4.)[:, None]
+    temperature = file_values("T2D")
+    expected = temperature[row] + weight * (temperature[row + 1] - temperature[row])
+    names = list(BmiForcing._forcing_var_names)
+    assert np.allclose(got[:, names.index(T2D)], expected, rtol=1e-6, atol=0)
+    rain = names.index('atmosphere_water__liquid_equivalent_precipitation_rate')
+    assert np.array_equal(got[:, rain], file_values("RAINRATE")[row])
+    held = run(start(config, Time_Step=900, Interpolation={"T2D": "constant"}), 8)
+    assert np.array_equal(held[:, names.index(T2D)], temperature[row[:8]])
+
+
+def write_shards(filename, pattern, sizes):
+    """Split the forcing of ``filename`` into consecutive time shards.
+
+    Parameters
+    ----------
+    filename : str
+        File written by ``make_forcing_file``.
+    pattern : str
+        Shard file names, formatted with the shard number.
+    sizes : list of int
+        Time steps of every shard.
+
+    Returns
+    -------
+    list of str
+        Shard files.
+    """
+    import netCDF4 as netcdf
+
+    # the file may be open in the pool of the runs read from it
+    with netcdf_lock:
+        pool.release(filename)
+    paths = []
+    beg = 0
+    with netcdf.Dataset(filename) as src:
+        for k, n in enumerate(sizes):
+            paths.append(pattern.format(k))
+            with netcdf.Dataset(paths[-1], "w") as nc:
+                nc.createDimension("catchment-id", len(src.dimensions["catchment-id"]))
+                nc.createDimension("Time", n)
+                for name, var in src.variables.items():
+                    out = nc.createVariable(name, var.dtype, var.dimensions)
+                    out.setncatts({a: var.getncattr(a) for a in var.ncattrs()})
+                    if "Time" not in var.dimensions:
+                        out[:] = var[:]
+                    elif var.dimensions == ("Time",):
+                        out[:] = var[beg:beg+n]
+                    else:
+                        out[:] = var[:, beg:beg+n]
+            beg += n
+    return paths
+
+
+def check_shards():
+    """A window spanning time shards is read as one timeline."""
+    shards = write_shards(forcing_file, os.path.join(data_dir, "shard_{0}.nc"), [10, 100, 150, N_TIMES - 260])
+    expected = run(start(config), 300)
+    bmi = start(config, Netcdf_File=shards, Shard_Index_File=os.path.join(data_dir, "shards.json"))
+    # the first shard ends before the window
+    assert len(bmi._model._files[0][2]) == 3
+    assert np.array_equal(run(bmi, 300), expected)
+
+
+def check_tail():
+    """Steps of shards written after initialize are appended and served."""
+    pattern = os.path.join(data_dir, "tail_{0}.nc")
+    shards = write_shards(forcing_file, os.path.join(data_dir, "new_{0}.nc"), [100, 100, N_TIMES - 200])
+    for k in range(2):
+        os.replace(shards[k], pattern.format(k))
+    bmi = start(config, Netcdf_File=pattern.format("*"), Tail_Interval=0,
+                Shard_Index_File=os.path.join(data_dir, "tail.json"))
+    end_time = bmi.get_end_time()
+    values = run(bmi, 150)
+    os.replace(shards[2], pattern.format(2))
+    values = np.concatenate([values, run(bmi, 201)[1:]])
+    assert bmi.get_end_time() > end_time
+    assert np.array_equal(values, run(start(config), 350))
+
+
+def check_subset():
+    """Scattered catchment ids are read in runs and served in their order."""
+    subset_file = os.path.join(data_dir, "subset.nc")
+    make_forcing_file(subset_file, 100, 48, seed=1)
+    ids = ["cat-90", "cat-5", "cat-2", "cat-91"]
+    bmi = start(config, Netcdf_File=subset_file, Catchment_IDs=ids,
+                end_time_date="2000-01-02 12:00:00")
+    runs, positions = bmi._model._catchment_selection(subset_file)
+    # rows 2 and 5 are bridged, 90 is more than _max_gap rows further
+    assert runs == [(2, 6), (90, 92)]
+    assert positions.tolist() == [4, 3, 0, 5]
+    with netcdf_lock:
+        temperature = np.asarray(pool.open(subset_file).variables["T2D"][:]).T
+    got = run(bmi, 12)[:, list(BmiForcing._forcing_var_names).index(T2D)]
+    assert np.array_equal(got, temperature[WINDOW_ROW:WINDOW_ROW+12][:, [90, 5, 2, 91]])
+    assert bmi._model._catchment_ids == ids
+
+
+def check_packing():
+    """An int16 store serves the forcing within half a packing step."""
+    expected = run(start(config), 100)
+    bmi = start(config, Storage_Precision="int16")
+    got = run(bmi, 100)
+    scale = bmi._model._scale[None, :, None]
+    assert got.dtype == np.float32
+    # half a step, plus the rounding of the float32 decoding
+    assert np.all(np.abs(got - expected) <= scale * 0.51)
+
+
+def write_time_file(filename, times, units, calendar="standard"):
+    """Write a one-catchment forcing file whose variables hold the row number.
+
+    Parameters
+    ----------
+    filename : str
+        File to write.
+    times : list of float
+        Values of ``Time``.
+    units, calendar : str
+        CF units and calendar of ``Time``.
+    """
+    import netCDF4 as netcdf
+
+    with netcdf_lock:
+        pool.release(filename)
+    with netcdf.Dataset(filename, "w") as nc:
+        nc.createDimension("catchment-id", 1)
+        nc.createDimension("Time", len(times))
+        time_var = nc.createVariable("Time", "f8", ("Time",))
+        time_var.units = units
+        time_var.calendar = calendar
+        time_var[:] = times
+        cat_id = nc.createVariable("catID", str, ("catchment-id",))
+        cat_id[:] = np.array(["cat-1"], dtype=object)
+        for name in ['LWDOWN', 'PSFC', 'Q2D', 'RAINRATE', 'SWDOWN', 'T2D', 'U2D', 'V2D']:
+            var = nc.createVariable(name, "f8", ("catchment-id", "Time"))
+            var.long_name = name
+            var.units = "1"
+            var[:] = np.arange(len(times), dtype=float)[None, :]
+
+
+def check_time_axis():
+    """Time units, calendars, irregular axes and starts between rows."""
+    time_file = os.path.join(data_dir, "time.nc")
+    names = list(BmiForcing._forcing_var_names)
+    rows = names.index(T2D), names.index('land_surface_radiation~incoming~longwave__energy_flux')
+
+    def served_rows(n_steps, **options):
+        bmi = start(config, Netcdf_File=time_file, **options)
+        return run(bmi, n_steps)[:, rows, 0].T, bmi.get_end_time()
+
+    # minutes, interpolated (T2D) and held (LWDOWN) at half hours
+    write_time_file(time_file, np.arange(0, 600, 60), "minutes since 2000-01-01 00:00:00")
+    (t2d, lwdown), end = served_rows(6, start_time_date="2000-01-01 03:00:00",
+                                     end_time_date="2000-01-01 07:00:00", Time_Step=1800)
+    assert t2d.tolist() == [3, 3.5, 4, 4.5, 5, 5.5] and lwdown.tolist() == [3, 3, 4, 4, 5, 5]
+    assert end == 7
+    # days of a calendar without 29 February
+    write_time_file(time_file, np.arange(6), "days since 2004-02-27 00:00:00", "noleap")
+    (t2d, _), end = served_rows(4, start_time_date="2004-03-01 00:00:00",
+                                end_time_date="2004-03-04 00:00:00", Time_Step=43200)
+    assert t2d.tolist() == [2, 2.5, 3, 3.5] and end == 5
+    # 30-day months
+    write_time_file(time_file, np.arange(6), "days since 2000-02-29 00:00:00", "360_day")
+    (t2d, _), _ = served_rows(2, start_time_date="2000-03-01 00:00:00",
+                              end_time_date="2000-03-03 00:00:00", Time_Step=86400)
+    assert t2d.tolist() == [2, 3]
+    # irregular hours, held across the gaps
+    write_time_file(time_file, [0, 1, 2, 4, 5, 8, 9], "hours since 2000-01-01 00:00:00")
+    (t2d, _), end = served_rows(10, start_time_date="2000-01-01 00:00:00",
+                                end_time_date="2000-01-02 00:00:00")
+    assert t2d.tolist() == [0, 1, 2, 2, 3, 4, 4, 4, 5, 6] and end == 9
+    # a start between 3-hourly rows, with an origin in UTC offset form
+    write_time_file(time_file, [0, 3, 6, 9], "hours since 2000-01-01 00:00:00 +00:00")
+    (t2d, lwdown), _ = served_rows(5, start_time_date="2000-01-01 02:00:00",
+                                   end_time_date="2000-01-01 09:00:00")
+    assert np.allclose(t2d, [2/3, 1, 4/3, 5/3, 2]) and lwdown.tolist() == [0, 1, 1, 1, 2]
+
+
+def check_shared_memory():
+    """A forcing server segment serves the forcing it was read from."""
+    from forcing_server import share_sources
+
+    segments = share_sources([config], named=True)
+    try:
+        bmi = start(config, Time_Step=1800, Forcing_Server=1)
+        assert bmi._model._shm is not None
+        assert np.array_equal(run(bmi, 2 * 200), run(start(config, Time_Step=1800), 2 * 200))
+        bmi.finalize()
+    finally:
+        for shm in segments.values():
+            shm.close()
+            shm.unlink()
+
+
+def check_areal_weights():
+    """Polygons are averaged over a grid with their coverage weights."""
+    import json
+
+    import netCDF4 as netcdf
+    from areal_weights import ArealWeights
+
+    # a 3 x 4 grid of unit cells whose values are 100*row + 10*y + x
+    grid_file = os.path.join(data_dir, "grid.nc")
+    x = np.arange(4) + 0.5
+    y = np.arange(3) + 0.5
+    with netcdf.Dataset(grid_file, "w") as nc:
+        nc.createDimension("Time", 48)
+        nc.createDimension("y", len(y))
+        nc.createDimension("x", len(x))
+        time_var = nc.createVariable("Time", "f8", ("Time",))
+        time_var.units = "hours since 2000-01-01 00:00:00"
+        time_var[:] = np.arange(48)
+        nc.createVariable("x", "f8", ("x",))[:] = x
+        nc.createVariable("y", "f8", ("y",))[:] = y
+        cells = 100. * np.arange(48)[:, None, None] + 10 * np.arange(3)[:, None] + np.arange(4)
+        for name in ['LWDOWN', 'PSFC', 'Q2D', 'RAINRATE', 'SWDOWN', 'T2D', 'U2D', 'V2D']:
+            var = nc.createVariable(name, "f8", ("Time", "y", "x"))
+            var.long_name = name
+            var.units = "1"
+            var[:] = cells
+    # half cells around a full one in two rows, and the grid with a
+    # two-cell hole
+    polygons = {"type": "FeatureCollection", "features": [
+        {"type": "Feature", "properties": {"id": "square"}, "geometry": {
+            "type": "Polygon", "coordinates": [[[0.5, 0.5], [2.5, 0.5], [2.5, 1.5], [0.5, 1.5], [0.5, 0.5]]]}},
+        {"type": "Feature", "properties": {"id": "holed"}, "geometry": {
+            "type": "Polygon", "coordinates": [[[0, 0], [4, 0], [4, 3], [0, 3], [0, 0]],
+                                               [[1, 1], [3, 1], [3, 2], [1, 2], [1, 1]]]}}]}
+    polygon_file = os.path.join(data_dir, "catchments.geojson")
+    with open(polygon_file, "w") as f:
+        json.dump(polygons, f)
+
+    weights = ArealWeights.from_polygons(polygon_file, x, y)
+    assert weights.catchment_ids == ["square", "holed"] and weights.grid_shape == (3, 4)
+    assert weights.indptr.tolist() == [0, 6, 16]
+    square = dict(zip(weights.indices[:6].tolist(), weights.weights[:6]))
+    assert square.keys() == {0, 1, 2, 4, 5, 6}
+    assert np.allclose([square[c] for c in (0, 1, 2, 4, 5, 6)], [.125, .25, .125, .125, .25, .125])
+    assert sorted(weights.indices[6:].tolist()) == [0, 1, 2, 3, 4, 7, 8, 9, 10, 11]
+    assert np.allclose(weights.weights[6:], 0.1)
+
+    weight_file = os.path.join(data_dir, "weights.npz")
+    expected = 100. * np.arange(24)[:, None] + [6, 11.5]
+    for _ in range(2):
+        # computed and saved to the weight file, then loaded from it
+        bmi = start(config, Netcdf_File=grid_file, Catchment_Polygons=polygon_file,
+                    Weight_File=weight_file, start_time_date="2000-01-01 00:00:00",
+                    end_time_date="2000-01-02 00:00:00")
+        assert np.allclose(run(bmi, 24)[:, BmiForcing._forcing_var_names.index(T2D)], expected)
+        bmi.finalize()
+        assert os.path.exists(weight_file)
+
+
+def check_derived():
+    """Derived variables follow their formulas across derived blocks."""
+    names = ["atmosphere_water__precipitation_leq-volume_flux", "land_surface_wind__speed",
+             "land_surface_air__relative_humidity", "land_surface_air__celsius_temperature"]
+    bmi = start(config)
+    got = []
+    for _ in range(200):
+        got.append(served(bmi, names))
+        bmi.update()
+    bmi.finalize()
+    got = np.array(got).swapaxes(0, 1)
+    row = slice(WINDOW_ROW, WINDOW_ROW + 200)
+    q, t, p = (file_values(name)[row].astype(np.float64) for name in ("Q2D", "T2D", "PSFC"))
+    # vapour pressure over the saturation vapour pressure in hPa of Bolton (1980)
+    vapour = q * p / (0.622 + 0.378 * q)
+    saturation = 100 * 6.112 * np.exp(17.67 * (t - 273.15) / (t + 243.5 - 273.15))
+    expected = [file_values("RAINRATE")[row] * 3600,
+                np.hypot(file_values("U2D")[row], file_values("V2D")[row]),
+                np.clip(vapour / saturation, 0, 1),
+                t - 273.15]
+    for name, values, want in zip(names, got, expected):
+        assert np.allclose(values, want, rtol=1e-5, atol=1e-5), name
+    # a derived state is interpolated between forcing steps like its input
+    bmi = start(config, Time_Step=1800)
+    half = []
+    for _ in range(4):
+        half.append(served(bmi, names[3:])[0])
+        bmi.update()
+    temperature = file_values("T2D")[WINDOW_ROW:WINDOW_ROW + 3] - 273.15
+    half = np.array(half)
+    assert np.allclose(half[::2], temperature[:2], rtol=1e-5)
+    assert np.allclose(half[1::2], (temperature[:2] + temperature[1:]) / 2, rtol=1e-5)
+
+
+def check_overrides():
+    """Values set for a time index are served at it only."""
+    bmi = start(config)
+    expected = run(start(config), 40)
+    bmi.set_value_at_time(T2D, 30, np.full(2, -1.), indices=np.array([1, 3]))
+    got = run(bmi, 40)
+    row = list(BmiForcing._forcing_var_names).index(T2D)
+    assert np.all(got[30, row, [1, 3]] == -1.)
+    got[30, row, [1, 3]] = expected[30, row, [1, 3]]
+    assert np.array_equal(got, expected)
+    assert np.all(bmi.get_values_for_range(25, 35, [T2D])[0, 5, [1, 3]] == -1.)
+    # the store is not written
+    assert np.array_equal(bmi._model.values_for_range(30, 31)[bmi._model._var_index["T2D"], 0],
+                          expected[30, row])
+
+
+def check_ensemble():
+    """Generated members are reproducible and member 0 is the control."""
+    options = dict(Ensemble_Members=4, Ensemble_Seed=7,
+                   Perturbations={"RAINRATE": {"multiplicative": 0.3}, "T2D": {"additive": 0.5}})
+    first = run(start(config, **options), 50)
+    bmi = start(config, **options)
+    assert bmi.get_grid_size(0) == 4 * N_CATCHMENTS
+    assert np.array_equal(run(bmi, 50), first)
+    assert np.array_equal(first[:, :, :N_CATCHMENTS], run(start(config), 50))
+    other = run(start(config, **dict(options, Ensemble_Seed=8)), 50)
+    assert not np.array_equal(other, first)
+
+
+def check_replay():
+    """A recorded run, with a jump, replays the values served."""
+    record_file = os.path.join(data_dir, "record.nc")
+    bmi = start(config, Time_Step=1800, Record_File=record_file, Record_Buffer=16)
+    bmi.set_value_at_time(T2D, 10, np.full(N_CATCHMENTS, 250.))
+    values = {}
+    for i in range(120):
+        values[bmi.get_current_time()] = served(bmi)
+        if i == 60:
+            bmi.update_until(bmi.get_current_time() + 25 * bmi.get_time_step())
+        else:
+            bmi.update()
+    values[bmi.get_current_time()] = served(bmi)
+    bmi.finalize()
+
+    replay = start(config, Netcdf_File=record_file, Time_Step=1800)
+    for index in sorted(values):
+        if replay.get_current_time() != index:
+            jump(replay, index)
+        assert np.array_equal(served(replay), values[index]), index
+    replay.finalize()
+
+
+print("\nBEGIN BMI FEATURE TEST\n**********************\n")
+
+with tempfile.TemporaryDirectory() as data_dir:
+    forcing_file = os.path.join(data_dir, "forcing.nc")
+    make_forcing_file(forcing_file, N_CATCHMENTS, N_TIMES)
+    config = {"start_time_date": "2000-01-02 00:00:00",
+              "end_time_date": "2000-01-18 00:00:00",
+              "Netcdf_File": forcing_file,
+              "Debug": 0}
+
+    for name, check in list(globals().items()):
+        if not name.startswith("check_"):
+            continue
+        try:
+            check()
+            print(" " + name + ": " + check.__doc__)
+            pass_count += 1
+        except Exception:
+            print("**FEATURE ERROR** in " + name)
+            traceback.print_exc()
+            fail_count += 1
+            fail_list.append(name)
+
+print("\nTotal feature check PASS: " + str(pass_count))
+print("Total feature check FAIL: " + str(fail_count))
+for ff in fail_list:
+    print("    " + ff)
+sys.exit(1 if fail_count else 0)
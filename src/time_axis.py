@@ -0,0 +1,205 @@
+"""Time axis of a forcing file.
+
+A ``TimeAxis`` is built once from the values, units and calendar of a
+``Time`` variable and maps dates to rows:
+
+    axis = TimeAxis(nc.variables['Time'][:], "hours since 2007-01-01 00:00:00")
+    beg = axis.index("2007-03-01 00:00:00")
+
+Units are seconds, minutes, hours or days since an origin. The standard
+(mixed Gregorian/Julian, treated as Gregorian) and proleptic Gregorian
+calendars use plain datetime arithmetic; other CF calendars (``noleap``,
+``360_day``, ...) go through ``cftime``. Rows of a regularly spaced axis
+are found in O(1), those of an irregular axis by bisection.
+"""
+
+import math
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+
+UNIT_SECONDS = {
+    "second": 1., "seconds": 1., "sec": 1., "secs": 1., "s": 1.,
+    "minute": 60., "minutes": 60., "min": 60., "mins": 60.,
+    "hour": 3600., "hours": 3600., "hr": 3600., "hrs": 3600., "h": 3600.,
+    "day": 86400., "days": 86400., "d": 86400.,
+}
+GREGORIAN = ("standard", "gregorian", "proleptic_gregorian")
+
+# relative tolerance of the spacing of a regular axis, and of a date
+# falling on a time step
+_RTOL = 1e-6
+
+
+def parse_date(date):
+    """``datetime`` of an ISO date string (or a datetime, returned as is).
+
+    Dates with a UTC offset are converted to naive UTC dates, so that they
+    can be compared with the naive dates of the configuration.
+    """
+    if isinstance(date, str):
+        text = date.strip().replace("T", " ")
+        if text.endswith("Z"):
+            text = text[:-1]
+        date = datetime.fromisoformat(text.replace(" UTC", "").strip())
+    if isinstance(date, datetime) and date.tzinfo is not None:
+        date = date.astimezone(timezone.utc).replace(tzinfo=None)
+    return date
+
+
+class TimeAxis(object):
+
+    """Rows of a time coordinate and their dates."""
+
+    def __init__(self, values, units, calendar="standard", step=None):
+        """Create the axis of a time coordinate.
+
+        Parameters
+        ----------
+        values : array_like
+            Increasing time values, in ``units``.
+        units : str
+            CF time units, ``<unit> since <origin>``.
+        calendar : str, optional
+            CF calendar.
+        step : float, optional
+            Spacing in ``units`` used beyond the ends of an axis with a
+            single value; one hour by default.
+        """
+        unit, sep, origin = units.strip().partition(" since ")
+        if not sep or unit.lower() not in UNIT_SECONDS:
+            raise ValueError("unsupported time units " + repr(units))
+        self.units = units
+        self.calendar = (calendar or "standard").lower()
+        self.unit_seconds = UNIT_SECONDS[unit.lower()]
+        self._origin = None
+        if self.calendar in GREGORIAN:
+            try:
+                self._origin = parse_date(origin)
+            except ValueError:
+                # unpadded fields, e.g. "1970-1-1 0:0:0"; left to cftime
+                pass
+        self.values = np.asarray(values, dtype=np.float64).reshape(-1)
+
+        # regular axes are described by their first value and spacing
+        self.step = step if step is not None else 3600. / self.unit_seconds
+        self.regular = True
+        if len(self.values) > 1:
+            spacing = np.diff(self.values)
+            if np.any(spacing <= 0):
+                raise ValueError("time values are not increasing")
+            self.step = float(spacing[0])
+            self.regular = bool(np.allclose(spacing, self.step, rtol=_RTOL, atol=0))
+            # spacing used to extrapolate before and after an irregular axis
+            self._last_step = float(spacing[-1])
+
+    @classmethod
+    def regular_axis(cls, n_times, units, step, calendar="standard", first=0.):
+        """Axis of ``n_times`` values ``first + i*step`` without storing them."""
+        axis = cls(np.array([first], dtype=np.float64), units, calendar, step=step)
+        axis._n_times = n_times
+        return axis
+
+    def __len__(self):
+        return getattr(self, "_n_times", len(self.values))
+
+    @property
+    def first(self):
+        """First time value (0 for an empty axis)."""
+        return float(self.values[0]) if len(self.values) > 0 else 0.
+
+    @property
+    def step_seconds(self):
+        """Spacing in seconds, or None when the axis is irregular."""
+        return self.step * self.unit_seconds if self.regular else None
+
+    def value(self, date):
+        """Time value of ``date`` in the units and calendar of the axis.
+
+        Parameters
+        ----------
+        date : str or datetime
+            ISO date, in the calendar of the axis.
+
+        Returns
+        -------
+        float
+            Time value, e.g. hours since the origin.
+        """
+        if self._origin is not None:
+            return (parse_date(date) - self._origin).total_seconds() / self.unit_seconds
+        import cftime
+
+        date = parse_date(date)
+        date = cftime.datetime(date.year, date.month, date.day, date.hour, date.minute,
+                               date.second, date.microsecond, calendar=self.calendar)
+        return float(cftime.date2num(date, self.units, self.calendar))
+
+    def date(self, row):
+        """Date of ``row`` (extrapolated beyond the ends of the axis).
+
+        Returns
+        -------
+        datetime or cftime.datetime
+            Date in the calendar of the axis.
+        """
+        value = self.row_value(row)
+        if self._origin is not None:
+            return self._origin + timedelta(seconds=value * self.unit_seconds)
+        import cftime
+
+        return cftime.num2date(value, self.units, self.calendar)
+
+    def row_value(self, row):
+        """Time value of ``row`` (extrapolated beyond the ends of the axis)."""
+        n = len(self)
+        if self.regular:
+            return self.first + row * self.step
+        if row < 0:
+            return self.first + row * self.step
+        if row >= n:
+            return float(self.values[-1]) + (row - n + 1) * self._last_step
+        return float(self.values[row])
+
+    def index(self, date):
+        """Row of the time step containing ``date``.
+
+        That is the last row whose time is at or before ``date``; dates
+        outside the axis are extrapolated with the spacing at its ends,
+        so rows may be negative or past the end.
+
+        Parameters
+        ----------
+        date : str or datetime
+            ISO date, in the calendar of the axis.
+
+        Returns
+        -------
+        int
+            Row index.
+        """
+        return self.value_index(self.value(date))
+
+    def value_index(self, value):
+        """Row of the time step containing time ``value``, see ``index``."""
+        if self.regular:
+            return _floor((value - self.first) / self.step)
+        if value < self.first:
+            return _floor((value - self.first) / self.step)
+        last = float(self.values[-1])
+        if value >= last:
+            return len(self.values) - 1 + _floor((value - last) / self._last_step)
+        tolerance = _RTOL * self.step
+        return int(np.searchsorted(self.values, value + tolerance, side="right")) - 1
+
+    def seconds_between(self, beg, end):
+        """Seconds from date ``beg`` to date ``end`` in the calendar of the axis."""
+        return (self.value(end) - self.value(beg)) * self.unit_seconds
+
+
+def _floor(x):
+    """``floor(x)``, taking values within rounding error of an integer as that integer."""
+    nearest = round(x)
+    if abs(x - nearest) < _RTOL:
+        return int(nearest)
+    return int(math.floor(x))